@@ -3,6 +3,54 @@ import json
 import os
 import traceback
 
+# Page classification / OCR helpers live in scripts/rag_manager.py (cheap to
+# import: its heavy dependencies load lazily)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'scripts'))
+
+# Docling converters cached by pipeline options, reused for every file
+# passed in the same invocation (model loading happens only once).
+_CONVERTERS = {}
+
+def get_converter(do_ocr=True, do_table_structure=True):
+    key = (do_ocr, do_table_structure)
+    if key in _CONVERTERS:
+        return _CONVERTERS[key]
+
+    # Lazy import Docling (heavy)
+    from docling.document_converter import DocumentConverter, PdfFormatOption
+    from docling.datamodel.base_models import InputFormat
+    from docling.datamodel.pipeline_options import PdfPipelineOptions
+
+    # Configure Pipeline (Enable OCR for fallback/images)
+    pipeline_options = PdfPipelineOptions()
+    pipeline_options.do_ocr = do_ocr
+    pipeline_options.do_table_structure = do_table_structure
+
+    converter = DocumentConverter(
+        format_options={
+            InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
+        } 
+    )
+
+    # Warm-up: load layout/table models now, not inside the first convert()
+    try:
+        converter.initialize_pipeline(InputFormat.PDF)
+    except Exception as e:
+        sys.stderr.write(f"[Docling Warm-up] {e}\n")
+
+    _CONVERTERS[key] = converter
+    return converter
+
+def extract_pdf_pages(file_path):
+    """
+    Per-page strategy shared with scripts/rag_manager.py: pages with a text
+    layer come from PyPDF; only image-only pages (ranges of up to
+    PDF_OCR_PAGES_PER_JOB pages) go through Docling OCR with this script's
+    converter. Returns (text, method, partial); partial means an OCR range failed.
+    """
+    from rag_manager import classify_pdf_pages, extract_pdf_text
+    return extract_pdf_text(file_path, get_converter(), classify_pdf_pages(file_path))
+
 def main():
     # Force UTF-8 for stdin/stdout
     sys.stdout.reconfigure(encoding='utf-8')
@@ -12,10 +60,19 @@ def main():
         print(json.dumps({"status": "error", "message": "No file path provided"}))
         return
 
-    file_path = sys.argv[1]
+    # Several paths may be given: the Docling converter is shared between them
+    # and one JSON line is printed per file.
+    file_paths = sys.argv[1:]
+    for file_path in file_paths:
+        result = process_file(file_path)
+        if len(file_paths) > 1:
+            result["file"] = file_path
+        print(json.dumps(result, ensure_ascii=False))
+        sys.stdout.flush()
+
+def process_file(file_path):
     if not os.path.exists(file_path):
-        print(json.dumps({"status": "error", "message": f"File not found: {file_path}"}))
-        return
+        return {"status": "error", "message": f"File not found: {file_path}"}
 
     try:
         from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -24,48 +81,28 @@ def main():
         ext = os.path.splitext(file_path)[1].lower()
         full_text = ""
         used_method = "unknown"
+        partial = False
 
-        # --- Strategy 1: PyPDF (Fastest, for Native PDFs) ---
+        # --- Strategy 1: PyPDF per page (fast), OCR only for image-only pages ---
         if ext == '.pdf':
             try:
-                from langchain_community.document_loaders import PyPDFLoader
-                loader = PyPDFLoader(file_path)
-                docs = loader.load()
-                # Check for empty content (Scanned PDF?)
-                extracted_text = "\n\n".join([d.page_content for d in docs])
-                
-                if extracted_text.strip():
-                    full_text = extracted_text
-                    used_method = "pypdf"
-                else:
-                    # Fallback to Docling if PyPDF returns empty
+                full_text, used_method, partial = extract_pdf_pages(file_path)
+                if not full_text.strip():
+                    # Fallback to Docling (whole document) if nothing came out
+                    full_text = ""
                     used_method = "docling_fallback"
             except Exception as e:
-                # Fallback to Docling on error
+                # Fallback to Docling on error (encrypted/broken PDF for PyPDF)
                 used_method = "docling_fallback_error"
 
         # --- Strategy 2: Docling (Robust, OCR, Universal) ---
         # Used for non-PDFs (docx, images) OR if PyPDF failed/was empty
         if not full_text:
             try:
-                # Lazy import Docling (heavy)
-                from docling.document_converter import DocumentConverter, PdfFormatOption
-                from docling.datamodel.base_models import InputFormat
-                from docling.datamodel.pipeline_options import PdfPipelineOptions
-
-                # Configure Pipeline (Enable OCR for fallback/images)
-                pipeline_options = PdfPipelineOptions()
-                pipeline_options.do_ocr = True 
-                pipeline_options.do_table_structure = True
-
-                converter = DocumentConverter(
-                    format_options={
-                        InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
-                    } 
-                )
-                
+                converter = get_converter()
                 result = converter.convert(file_path)
                 full_text = result.document.export_to_markdown()
+                partial = False
                 
                 if used_method == "unknown":
                     used_method = "docling_primary"
@@ -74,12 +111,10 @@ def main():
                 if used_method == "unknown":
                     raise e # No other method to try
                 # If fallback failed, maybe just return error
-                print(json.dumps({"status": "error", "message": f"Docling failed after fallback: {str(e)}"}))
-                return
+                return {"status": "error", "message": f"Docling failed after fallback: {str(e)}"}
 
         if not full_text:
-             print(json.dumps({"status": "error", "message": "No text extracted using any method."}))
-             return
+             return {"status": "error", "message": "No text extracted using any method."}
 
         # --- Splitting (LangChain) ---
         
@@ -99,17 +134,19 @@ def main():
         )
         chunks = text_splitter.split_text(full_text)
 
-        # Output
-        print(json.dumps({
+        # Output (partial: some image-only pages failed OCR and are missing;
+        # callers should not treat the file as fully ingested)
+        return {
             "status": "success", 
             "content": full_text, 
             "chunks": chunks,
-            "method": used_method
-        }, ensure_ascii=False))
+            "method": used_method,
+            "partial": partial
+        }
 
     except Exception as e:
         err_msg = f"{str(e)}\n{traceback.format_exc()}"
-        print(json.dumps({"status": "error", "message": err_msg}))
+        return {"status": "error", "message": err_msg}
 
 if __name__ == "__main__":
     main()
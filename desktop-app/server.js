@@ -253,6 +253,24 @@ app.post('/api/query-ai', async (req, res) => {
     } catch (e) { res.status(500).json({ error: e.message }); }
 });
 
+// Streaming: uma linha JSON por evento (delta/tool_start/tool_end) e "done" no final
+app.post('/api/query-ai/stream', async (req, res) => {
+    res.setHeader('Content-Type', 'application/x-ndjson; charset=utf-8');
+    res.setHeader('Cache-Control', 'no-cache');
+    const write = (obj) => res.write(JSON.stringify(obj) + '\n');
+    try {
+        const { query } = req.body;
+        const answer = await aiService.processQuery(query, {
+            onDelta: (text) => write({ status: 'delta', data: text }),
+            onEvent: (event) => write(event)
+        });
+        write({ status: 'done', data: answer });
+    } catch (e) {
+        write({ status: 'error', message: e.message });
+    }
+    res.end();
+});
+
 app.post('/api/knowledge/ingest', async (req, res) => {
     try {
         const result = await knowledgeService.ingestAll();
@@ -110,6 +110,102 @@ try {
   console.error("Erro ao verificar/adicionar coluna userTurno em faltas:", err);
 }
 
+// Índices de faltas para consultas por período. faltas.date é dd/mm/aaaa, que
+// não ordena como data; o índice de expressão guarda a forma aaaa-mm-dd.
+// As consultas precisam usar exatamente a mesma expressão (ver ai_agent.py).
+db.exec(`
+  CREATE INDEX IF NOT EXISTS idx_faltas_isodate
+    ON faltas ((substr(date, 7, 4) || '-' || substr(date, 4, 2) || '-' || substr(date, 1, 2)));
+  CREATE INDEX IF NOT EXISTS idx_faltas_user_isodate
+    ON faltas (userId, (substr(date, 7, 4) || '-' || substr(date, 4, 2) || '-' || substr(date, 1, 2)));
+`);
+
+// --- Rollup Diário de Presença ---
+// Uma linha por (dia local, aluno) com a primeira Entrada do dia, mantida por
+// triggers em activities. Consultas "quem está presente no dia X" leem só as
+// linhas daquele dia (chave primária), sem varrer o histórico de batidas.
+db.exec(`
+  CREATE INDEX IF NOT EXISTS idx_activities_user_timestamp ON activities (userId, timestamp);
+  CREATE INDEX IF NOT EXISTS idx_activities_timestamp ON activities (timestamp);
+
+  CREATE TABLE IF NOT EXISTS attendance_daily (
+    day TEXT NOT NULL,
+    userId INTEGER NOT NULL,
+    userName TEXT,
+    firstEntry TEXT NOT NULL,
+    entries INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (day, userId)
+  ) WITHOUT ROWID;
+`);
+
+// Recalcula a linha (dia, aluno) de uma atividade removida/alterada.
+// Timestamps são ISO UTC: o dia local vira uma faixa UTC (usa o índice userId+timestamp).
+const rollupRecomputeSql = (row) => `
+    DELETE FROM attendance_daily
+    WHERE day = date(${row}.timestamp, 'localtime') AND userId = ${row}.userId;
+    INSERT INTO attendance_daily (day, userId, userName, firstEntry, entries)
+    SELECT date(${row}.timestamp, 'localtime'), userId, max(userName), min(timestamp), count(*)
+    FROM activities
+    WHERE userId = ${row}.userId AND type = 'Entrada'
+      AND timestamp >= strftime('%Y-%m-%dT%H:%M:%S', date(${row}.timestamp, 'localtime'), 'utc')
+      AND timestamp < strftime('%Y-%m-%dT%H:%M:%S', date(${row}.timestamp, 'localtime'), '+1 day', 'utc')
+    GROUP BY userId;`;
+
+db.exec(`
+  CREATE TRIGGER IF NOT EXISTS trg_attendance_insert AFTER INSERT ON activities
+  WHEN NEW.type = 'Entrada'
+  BEGIN
+    INSERT INTO attendance_daily (day, userId, userName, firstEntry, entries)
+    VALUES (date(NEW.timestamp, 'localtime'), NEW.userId, NEW.userName, NEW.timestamp, 1)
+    ON CONFLICT(day, userId) DO UPDATE SET
+      entries = entries + 1,
+      firstEntry = min(firstEntry, excluded.firstEntry);
+  END;
+
+  CREATE TRIGGER IF NOT EXISTS trg_attendance_delete AFTER DELETE ON activities
+  WHEN OLD.type = 'Entrada'
+  BEGIN ${rollupRecomputeSql('OLD')}
+  END;
+
+  CREATE TRIGGER IF NOT EXISTS trg_attendance_update AFTER UPDATE OF userId, type, timestamp ON activities
+  WHEN OLD.type = 'Entrada' OR NEW.type = 'Entrada'
+  BEGIN ${rollupRecomputeSql('OLD')} ${rollupRecomputeSql('NEW')}
+  END;
+`);
+
+// Backfill: reconstrói o rollup a partir de todo o histórico de activities
+function rebuildAttendanceRollup() {
+  const rebuild = db.transaction(() => {
+    db.exec('DELETE FROM attendance_daily');
+    return db.prepare(`
+      INSERT INTO attendance_daily (day, userId, userName, firstEntry, entries)
+      SELECT date(timestamp, 'localtime'), userId, max(userName), min(timestamp), count(*)
+      FROM activities
+      WHERE type = 'Entrada'
+      GROUP BY date(timestamp, 'localtime'), userId
+    `).run().changes;
+  });
+  return rebuild();
+}
+
+// Banco existente antes do rollup: preencher uma única vez
+try {
+  const rollupEmpty = !db.prepare('SELECT 1 FROM attendance_daily LIMIT 1').get();
+  const hasEntries = db.prepare("SELECT 1 FROM activities WHERE type = 'Entrada' LIMIT 1").get();
+  if (rollupEmpty && hasEntries) {
+    const days = rebuildAttendanceRollup();
+    console.log(`[DB] Rollup de presença preenchido (${days} registros aluno/dia).`);
+  }
+} catch (err) {
+  console.error("[DB] Erro ao preencher rollup de presença:", err);
+}
+
+function getAttendanceByDay(day) {
+  // day no formato 'YYYY-MM-DD' (dia local)
+  const stmt = db.prepare('SELECT * FROM attendance_daily WHERE day = ? ORDER BY firstEntry');
+  return stmt.all(day);
+}
+
 // --- Migração de Turnos (Inferir baseada no histórico) ---
 function inferAndPopulateUserTurnos() {
   try {
@@ -608,5 +704,7 @@ module.exports = {
   addFalta,
   getFaltas,
   deleteFalta,
-  initializeTodaysFaltas
+  initializeTodaysFaltas,
+  getAttendanceByDay,
+  rebuildAttendanceRollup
 };
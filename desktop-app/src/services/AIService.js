@@ -10,7 +10,9 @@ const { spawn } = require('child_process');
 class AIService {
     constructor() {
         this.pythonProcess = null;
-        this.requestQueue = [];
+        // Pending requests by id: the agent answers concurrently, out of order
+        this.pendingRequests = new Map();
+        this.nextRequestId = 1;
         this.buffer = '';
         this.initialized = false;
     }
@@ -56,10 +58,11 @@ class AIService {
             this.pythonProcess = null;
             this.initialized = false;
             // Reject pending requests
-            while (this.requestQueue.length > 0) {
-                const req = this.requestQueue.shift();
+            for (const req of this.pendingRequests.values()) {
+                clearTimeout(req.timer);
                 req.resolve({ error: 'Agent process terminated' });
             }
+            this.pendingRequests.clear();
         });
 
         this.initialized = true;
@@ -79,17 +82,35 @@ class AIService {
 
             try {
                 const response = JSON.parse(line);
-                const req = this.requestQueue.shift();
-
-                if (req) {
-                    if (response.status === 'success') {
-                        req.resolve(response.data);
-                    } else if (response.status === 'pong') {
-                        req.resolve(response);
-                    } else {
-                        console.error('[Veritas AI] Agent Error:', response);
-                        req.resolve(response.message || 'Erro no agente de IA.');
+                const req = this.pendingRequests.get(response.id);
+
+                if (!req) {
+                    // Late reply (already timed out) or error without id
+                    console.warn('[Veritas AI] Resposta sem requisição pendente:', line.substring(0, 200));
+                    continue;
+                }
+
+                // Streaming: eventos intermediários mantêm a requisição viva
+                if (response.status === 'delta' || response.status === 'tool_start' || response.status === 'tool_end') {
+                    req.armTimer();
+                    if (response.status === 'delta') {
+                        if (req.onDelta) req.onDelta(response.data);
+                    } else if (req.onEvent) {
+                        req.onEvent(response);
                     }
+                    continue;
+                }
+
+                this.pendingRequests.delete(response.id);
+                clearTimeout(req.timer);
+
+                if (response.status === 'success' || response.status === 'done') {
+                    req.resolve(response.data);
+                } else if (response.status === 'pong') {
+                    req.resolve(response);
+                } else {
+                    console.error('[Veritas AI] Agent Error:', response);
+                    req.resolve(response.message || 'Erro no agente de IA.');
                 }
             } catch (e) {
                 console.error('[Veritas AI] JSON Parse error:', e, "Raw:", line);
@@ -97,31 +118,44 @@ class AIService {
         }
     }
 
-    async processQuery(userQuery) {
+    /**
+     * Envia uma consulta ao agente e resolve com a resposta completa.
+     * Com options.onDelta / options.onEvent a consulta é feita em modo streaming:
+     * onDelta(texto) recebe cada trecho gerado e onEvent({status, tool, args})
+     * recebe o início/fim das chamadas de ferramentas.
+     */
+    async processQuery(userQuery, options = {}) {
         if (!this.pythonProcess) await this.initialize();
         if (!this.pythonProcess) return "Erro Crítico: O agente de IA não foi inicializado corretamente.";
 
+        const { onDelta, onEvent } = options;
+        const stream = Boolean(onDelta || onEvent);
+
         return new Promise((resolve, reject) => {
-            const req = { resolve, reject };
-            this.requestQueue.push(req);
-
-            // Timeout
-            setTimeout(() => {
-                const idx = this.requestQueue.indexOf(req);
-                if (idx > -1) {
-                    this.requestQueue.splice(idx, 1);
-                    console.error("[Veritas AI] Query Timeout.");
-                    resolve("Erro: Tempo limite excedido ao processar a consulta.");
-                }
-            }, 60000); // 60s timeout
+            const id = this.nextRequestId++;
+            const req = { resolve, reject, onDelta, onEvent };
+            this.pendingRequests.set(id, req);
+
+            // Timeout (a late reply is dropped in handleData, not given to another caller).
+            // In streaming mode every event re-arms it, so it measures inactivity.
+            req.armTimer = () => {
+                clearTimeout(req.timer);
+                req.timer = setTimeout(() => {
+                    if (this.pendingRequests.delete(id)) {
+                        console.error(`[Veritas AI] Query Timeout (#${id}).`);
+                        resolve("Erro: Tempo limite excedido ao processar a consulta.");
+                    }
+                }, 60000); // 60s timeout
+            };
+            req.armTimer();
 
             try {
-                const payload = JSON.stringify({ action: "query", query: userQuery }) + "\n";
+                const payload = JSON.stringify({ id, action: "query", query: userQuery, stream }) + "\n";
                 this.pythonProcess.stdin.write(payload);
             } catch (err) {
                 console.error("[Veritas AI] Write error:", err);
-                const idx = this.requestQueue.indexOf(req);
-                if (idx > -1) this.requestQueue.splice(idx, 1);
+                clearTimeout(req.timer);
+                this.pendingRequests.delete(id);
                 resolve("Erro ao enviar consulta para o agente.");
             }
         });
@@ -5,14 +5,39 @@ const { spawn } = require('child_process');
 class KnowledgeService {
     constructor() {
         this._startupIngestRun = false;
+        this.searchDaemon = null;
     }
 
     async initialize() {
+        // Serviço de busca residente (modelo carregado uma vez para todos os clientes)
+        this.startSearchDaemon();
         // Auto-ingest on startup
         this.runStartupIngest();
         console.log('[Knowledge] Serviço de Ingestão (RAG) pronto.');
     }
 
+    getPythonCommand() {
+        const projectRoot = path.join(__dirname, '../../../');
+        const localPythonCmd = path.join(projectRoot, 'python_portable', 'python.exe');
+        return fs.existsSync(localPythonCmd) ? localPythonCmd : 'python';
+    }
+
+    startSearchDaemon() {
+        if (this.searchDaemon) return;
+
+        const scriptPath = path.join(__dirname, '../../../scripts/rag_manager.py');
+        // stdin fica aberto: o daemon encerra sozinho quando o app fecha
+        this.searchDaemon = spawn(this.getPythonCommand(), [scriptPath, 'daemon'], {
+            env: { ...process.env, PYTHONIOENCODING: 'utf-8' },
+            stdio: ['pipe', 'ignore', 'pipe']
+        });
+        this.searchDaemon.stderr.on('data', d => console.log(`[RAG Daemon]: ${d.toString().trim()}`));
+        this.searchDaemon.on('exit', (code) => {
+            console.warn(`[Knowledge] Daemon de busca encerrado (código ${code}).`);
+            this.searchDaemon = null;
+        });
+    }
+
     async runStartupIngest() {
         if (this._startupIngestRun) return;
         this._startupIngestRun = true;
@@ -47,9 +72,7 @@ class KnowledgeService {
         return new Promise((resolve, reject) => {
             const scriptPath = path.join(__dirname, '../../../scripts/rag_manager.py');
             // Check for portable python
-            const projectRoot = path.join(__dirname, '../../../');
-            const localPythonCmd = path.join(projectRoot, 'python_portable', 'python.exe');
-            const pythonCommand = fs.existsSync(localPythonCmd) ? localPythonCmd : 'python';
+            const pythonCommand = this.getPythonCommand();
 
             const ingestProc = spawn(pythonCommand, [scriptPath, 'ingest', sourceDir], {
                 env: { ...process.env, PYTHONIOENCODING: 'utf-8' }
@@ -6,8 +6,18 @@ Replaces LangChain-based AIService.js
 import sys
 import os
 import json
+import re
+import bisect
+import pickle
+import hashlib
+import itertools
+import unicodedata
 import sqlite3
-from datetime import datetime
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.request import pathname2url
 
 # Add portable libs if available
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -15,9 +25,10 @@ project_root = os.path.dirname(script_dir)
 portable_lib_path = os.path.join(project_root, 'python_portable', 'Lib', 'site-packages')
 if os.path.exists(portable_lib_path):
     sys.path.insert(0, portable_lib_path)
+# rag_manager lives next to this script (lazy `from rag_manager import ...`);
+# don't rely on sys.path[0] being the scripts dir
+sys.path.insert(0, script_dir)
 
-from agno.agent import Agent
-from agno.models.groq import Groq
 import warnings
 
 # Suppress warnings from lancedb/pydantic
@@ -37,8 +48,64 @@ except ImportError:
 def get_db_path():
     return os.path.join(project_root, 'desktop-app', 'data', 'veritas.sqlite')
 
+# One read-only connection per thread (queries run on the agent thread pool).
+# The Electron app keeps veritas.sqlite in WAL mode, so these readers never
+# block its fingerprint writes; sqlite3 only opens a transaction for DML, so no
+# read snapshot is held between tool calls. Statements are cached per connection.
+_db_local = threading.local()
+
+def _open_readonly(path):
+    uri = 'file:' + pathname2url(path) + '?mode=ro'
+    try:
+        conn = sqlite3.connect(uri, uri=True, timeout=5, cached_statements=256)
+        conn.execute('SELECT 1 FROM sqlite_master LIMIT 1')
+    except sqlite3.OperationalError:
+        # mode=ro cannot create the -shm file when the app is not running
+        conn = sqlite3.connect(path, timeout=5, cached_statements=256)
+    conn.execute('PRAGMA query_only = ON')
+    return conn
+
 def get_db_connection():
-    return sqlite3.connect(get_db_path())
+    """
+    Returns this thread's pooled read-only connection (do not close it).
+    Reopened when the database file is replaced (hot swap / restore).
+    """
+    path = get_db_path()
+    try:
+        st = os.stat(path)
+        ident = (st.st_dev, st.st_ino)
+    except OSError:
+        ident = None
+
+    conn = getattr(_db_local, 'conn', None)
+    if conn is not None and _db_local.ident == ident:
+        return conn
+    if conn is not None:
+        conn.close()
+    conn = _open_readonly(path)
+    _db_local.conn = conn
+    _db_local.ident = ident
+    return conn
+
+# --- Knowledge Base (resident) ---
+def get_knowledge_db_path():
+    return os.path.join(project_root, 'desktop-app', 'data', 'knowledge.lance')
+
+_retriever = None
+_retriever_lock = threading.Lock()
+
+def get_retriever():
+    """
+    Process-wide retriever: the embedder and the LanceDB table are loaded once
+    (on first use) and the table is reopened only after a new ingest commit.
+    """
+    global _retriever
+    with _retriever_lock:
+        if _retriever is None:
+            # Same engine as rag_manager serve; honours VERITAS_EMBED_BACKEND
+            from rag_manager import KnowledgeRetriever
+            _retriever = KnowledgeRetriever(db_path=get_knowledge_db_path())
+    return _retriever
 
 # --- Tool Functions ---
 def search_students(query: str) -> str:
@@ -60,7 +127,6 @@ def search_students(query: str) -> str:
     """, (f'%{normalized}%', f'%{normalized}%'))
     
     rows = cursor.fetchall()
-    conn.close()
     
     if not rows:
         return "Nenhum aluno encontrado com esse nome/termo."
@@ -106,7 +172,6 @@ def check_attendance(date_filter: str) -> str:
             WHERE f.date = ?
         """, (today,))
         rows = cursor.fetchall()
-        conn.close()
         
         if not rows:
             return f"Não há registros de faltas para hoje ({today})."
@@ -114,13 +179,19 @@ def check_attendance(date_filter: str) -> str:
         formatted = ", ".join([f"{r[0]} (Turno: {r[1]})" for r in rows])
         return f"Total de {len(rows)} faltas hoje ({today}): {formatted}"
     
-    # Present students
-    cursor.execute("""
-        SELECT DISTINCT a.userName FROM activities a
-        WHERE date(a.timestamp) = date('now', 'localtime') AND a.type = 'Entrada'
-    """)
+    # Present students: daily rollup maintained by the app (primary key lookup)
+    try:
+        cursor.execute("""
+            SELECT userName FROM attendance_daily
+            WHERE day = ? ORDER BY firstEntry
+        """, (datetime.now().strftime('%Y-%m-%d'),))
+    except sqlite3.OperationalError:
+        # Database created by an older app version (no rollup table yet)
+        cursor.execute("""
+            SELECT DISTINCT a.userName FROM activities a
+            WHERE date(a.timestamp) = date('now', 'localtime') AND a.type = 'Entrada'
+        """)
     rows = cursor.fetchall()
-    conn.close()
     
     names = [r[0] for r in rows]
     if not names:
@@ -128,6 +199,383 @@ def check_attendance(date_filter: str) -> str:
     return f"Alunos presentes hoje ({today}): {', '.join(names)}"
 
 
+# --- Presença por período / por aluno (agregação em SQL) ---
+ATTENDANCE_PAGE_SIZE = 20
+ATTENDANCE_DEFAULT_DAYS = 30
+
+# Mesma expressão dos índices idx_faltas_isodate/idx_faltas_user_isodate em
+# database.js (faltas.date é dd/mm/aaaa). Alterar aqui exige alterar lá.
+FALTAS_ISO_DATE = "(substr(f.date, 7, 4) || '-' || substr(f.date, 4, 2) || '-' || substr(f.date, 1, 2))"
+
+# Uma linha por (aluno, dia local): primeira Entrada e última Saída do dia
+DAILY_PRESENCE_CTE = """
+    daily AS (
+        SELECT a.userId, MAX(a.userName) AS userName,
+               date(a.timestamp, 'localtime') AS day,
+               MIN(CASE WHEN a.type = 'Entrada' THEN a.timestamp END) AS firstIn,
+               MAX(CASE WHEN a.type <> 'Entrada' THEN a.timestamp END) AS lastOut
+        FROM activities a
+        WHERE a.timestamp >= ? AND a.timestamp < ? {user_filter}
+        GROUP BY a.userId, day
+    )"""
+
+HOURS_EXPR = "CASE WHEN lastOut > firstIn THEN (julianday(lastOut) - julianday(firstIn)) * 24 ELSE 0 END"
+
+
+def parse_date(value, default=None):
+    """Aceita AAAA-MM-DD, DD/MM/AAAA, 'hoje'/'today' ou vazio (usa default)."""
+    value = (value or '').strip().lower()
+    if not value:
+        return default
+    if value in ('hoje', 'today'):
+        return datetime.now().date()
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%d/%m/%y'):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Data inválida: '{value}'. Use AAAA-MM-DD ou DD/MM/AAAA.")
+
+
+def resolve_period(start_date, end_date):
+    """
+    Converte o período local [início, fim] nos limites usados pelas consultas:
+    timestamps UTC (activities) e datas ISO (faltas).
+    """
+    end = parse_date(end_date, datetime.now().date())
+    start = parse_date(start_date, end - timedelta(days=ATTENDANCE_DEFAULT_DAYS - 1))
+    if start > end:
+        start, end = end, start
+
+    def to_utc(day):
+        local_midnight = datetime(day.year, day.month, day.day).astimezone()
+        return local_midnight.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+
+    return {
+        "start": start,
+        "end": end,
+        "ts_from": to_utc(start),
+        "ts_to": to_utc(end + timedelta(days=1)),  # exclusivo
+        "iso_from": start.isoformat(),
+        "iso_to": end.isoformat(),
+    }
+
+
+def find_student_ids(cursor, student):
+    """Ids/nomes de alunos cujo nome contém o termo (mesma regra de search_students)."""
+    cursor.execute("""
+        SELECT id, nome FROM users WHERE LOWER(nome) LIKE ? ORDER BY nome LIMIT 50
+    """, (f'%{student.lower()}%',))
+    return cursor.fetchall()
+
+
+def paginate(total, page):
+    pages = max(1, -(-total // ATTENDANCE_PAGE_SIZE))
+    page = min(max(1, int(page or 1)), pages)
+    return page, pages, (page - 1) * ATTENDANCE_PAGE_SIZE
+
+
+def attendance_summary(start_date: str = "", end_date: str = "", student: str = "", page: int = 1) -> str:
+    """
+    Resumo de presença e faltas por aluno em um período: dias presentes,
+    primeira e última batida, horas presentes e número de faltas.
+    
+    Args:
+        start_date: Data inicial (AAAA-MM-DD ou DD/MM/AAAA). Vazio = 30 dias antes do fim.
+        end_date: Data final (inclusive). Vazio = hoje.
+        student: Filtro opcional por nome do aluno
+        page: Página do resultado (20 alunos por página)
+    """
+    try:
+        period = resolve_period(start_date, end_date)
+    except ValueError as e:
+        return str(e)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    ids = None
+    if student:
+        ids = [r[0] for r in find_student_ids(cursor, student)]
+        if not ids:
+            return "Nenhum aluno encontrado com esse nome/termo."
+
+    marks = ", ".join("?" * len(ids)) if ids else ""
+    activity_filter = f"AND a.userId IN ({marks})" if ids else ""
+    faltas_filter = f"AND f.userId IN ({marks})" if ids else ""
+    params = [period["ts_from"], period["ts_to"], *(ids or []),
+              period["iso_from"], period["iso_to"], *(ids or [])]
+
+    sql = f"""
+        WITH {DAILY_PRESENCE_CTE.format(user_filter=activity_filter)},
+        presence AS (
+            SELECT userId, MAX(userName) AS userName,
+                   COUNT(firstIn) AS daysPresent,
+                   MIN(firstIn) AS firstEntry,
+                   MAX(COALESCE(lastOut, firstIn)) AS lastEntry,
+                   SUM({HOURS_EXPR}) AS hours
+            FROM daily GROUP BY userId
+        ),
+        absence AS (
+            SELECT f.userId, MAX(f.userName) AS userName, COUNT(*) AS absences
+            FROM faltas f
+            WHERE {FALTAS_ISO_DATE} BETWEEN ? AND ? {faltas_filter}
+            GROUP BY f.userId
+        ),
+        ids AS (SELECT userId FROM presence UNION SELECT userId FROM absence)
+        SELECT COALESCE(p.userName, ab.userName) AS nome,
+               COALESCE(p.daysPresent, 0),
+               datetime(p.firstEntry, 'localtime'),
+               datetime(p.lastEntry, 'localtime'),
+               ROUND(COALESCE(p.hours, 0), 1),
+               COALESCE(ab.absences, 0),
+               COUNT(*) OVER () AS total
+        FROM ids
+        LEFT JOIN presence p ON p.userId = ids.userId
+        LEFT JOIN absence ab ON ab.userId = ids.userId
+        ORDER BY nome
+        LIMIT ? OFFSET ?
+    """
+    # O total vem junto da página (COUNT(*) OVER); página além do fim volta para a primeira
+    page = max(1, int(page or 1))
+    cursor.execute(sql, params + [ATTENDANCE_PAGE_SIZE, (page - 1) * ATTENDANCE_PAGE_SIZE])
+    rows = cursor.fetchall()
+    if not rows and page > 1:
+        page = 1
+        cursor.execute(sql, params + [ATTENDANCE_PAGE_SIZE, 0])
+        rows = cursor.fetchall()
+    total = rows[0][6] if rows else 0
+    page, pages, _ = paginate(total, page)
+
+    if not rows:
+        return (f"Nenhum registro de presença ou falta entre "
+                f"{period['start']:%d/%m/%Y} e {period['end']:%d/%m/%Y}.")
+
+    return json.dumps({
+        "periodo": f"{period['start']:%d/%m/%Y} a {period['end']:%d/%m/%Y}",
+        "total_alunos": total,
+        "pagina": page,
+        "paginas": pages,
+        "alunos": [{
+            "nome": r[0],
+            "dias_presentes": r[1],
+            "primeira_entrada": r[2],
+            "ultima_batida": r[3],
+            "horas_presentes": r[4],
+            "faltas": r[5],
+        } for r in rows],
+    }, ensure_ascii=False)
+
+
+def student_attendance(student: str, start_date: str = "", end_date: str = "", page: int = 1) -> str:
+    """
+    Histórico diário de um aluno em um período: entrada, saída e horas de
+    cada dia presente, mais as datas de falta.
+    
+    Args:
+        student: Nome do aluno
+        start_date: Data inicial (AAAA-MM-DD ou DD/MM/AAAA). Vazio = 30 dias antes do fim.
+        end_date: Data final (inclusive). Vazio = hoje.
+        page: Página do histórico diário (20 dias por página)
+    """
+    try:
+        period = resolve_period(start_date, end_date)
+    except ValueError as e:
+        return str(e)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    matches = find_student_ids(cursor, student)
+    if not matches:
+        return "Nenhum aluno encontrado com esse nome/termo."
+    exact = [m for m in matches if m[1] and m[1].lower() == student.lower()]
+    if len(matches) > 1 and len(exact) != 1:
+        names = ", ".join(m[1] for m in matches[:10])
+        return f"Mais de um aluno corresponde a '{student}': {names}. Especifique o nome completo."
+    user_id, user_name = (exact or matches)[0]
+
+    cursor.execute(f"""
+        WITH {DAILY_PRESENCE_CTE.format(user_filter="AND a.userId = ?")}
+        SELECT COUNT(firstIn), ROUND(SUM({HOURS_EXPR}), 1), COUNT(*)
+        FROM daily
+    """, (period["ts_from"], period["ts_to"], user_id))
+    days_present, hours, total_days = cursor.fetchone()
+
+    cursor.execute(f"""
+        SELECT f.date FROM faltas f
+        WHERE f.userId = ? AND {FALTAS_ISO_DATE} BETWEEN ? AND ?
+        ORDER BY {FALTAS_ISO_DATE}
+    """, (user_id, period["iso_from"], period["iso_to"]))
+    absences = [r[0] for r in cursor.fetchall()]
+
+    page, pages, offset = paginate(total_days, page)
+    cursor.execute(f"""
+        WITH {DAILY_PRESENCE_CTE.format(user_filter="AND a.userId = ?")}
+        SELECT day,
+               time(firstIn, 'localtime'),
+               time(lastOut, 'localtime'),
+               ROUND({HOURS_EXPR}, 2)
+        FROM daily
+        ORDER BY day
+        LIMIT ? OFFSET ?
+    """, (period["ts_from"], period["ts_to"], user_id, ATTENDANCE_PAGE_SIZE, offset))
+    days = cursor.fetchall()
+
+    return json.dumps({
+        "aluno": user_name,
+        "periodo": f"{period['start']:%d/%m/%Y} a {period['end']:%d/%m/%Y}",
+        "dias_presentes": days_present or 0,
+        "horas_presentes": hours or 0,
+        "total_faltas": len(absences),
+        # Datas de falta também limitadas para não inundar o contexto
+        "faltas": absences[:ATTENDANCE_PAGE_SIZE * 2],
+        "pagina": page,
+        "paginas": pages,
+        "dias": [{
+            "data": datetime.strptime(d[0], '%Y-%m-%d').strftime('%d/%m/%Y'),
+            "entrada": d[1],
+            "saida": d[2],
+            "horas": d[3],
+        } for d in days],
+    }, ensure_ascii=False)
+
+
+# --- Assistidos (planilha indexada em memória) ---
+ASSISTIDOS_PATH = os.path.join(project_root, 'data', 'LISTA DE ASSISTIDOS.xlsx')
+ASSISTIDOS_INDEX_PATH = os.path.join(project_root, 'data', '.assistidos_index.pkl')
+ASSISTIDOS_INDEX_VERSION = 1
+
+def normalize_text(value: str) -> str:
+    """Lowercase without accents ('Conceição' -> 'conceicao')."""
+    decomposed = unicodedata.normalize('NFKD', value)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+class AssistidosIndex:
+    """
+    In-memory index of the Assistidos spreadsheet: accent/case-normalized names
+    and a sorted token list for prefix lookups. Rebuilt only when the file
+    changes (mtime/size, confirmed by sha1) and persisted in a pickle side-car,
+    so a new agent process does not parse the xlsx again.
+    """
+
+    def __init__(self, excel_path, cache_path):
+        self.excel_path = excel_path
+        self.cache_path = cache_path
+        self.signature = None
+        # (rows, normalized, tokens), replaced as a whole so concurrent searches
+        # never mix lists from two versions of the sheet:
+        #   rows: (patient, student) in sheet order; normalized: the same,
+        #   normalized; tokens: sorted (token, row index)
+        self.data = ([], [], [])
+        self._lock = threading.Lock()
+
+    def _signature(self):
+        st = os.stat(self.excel_path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _sha1(self):
+        h = hashlib.sha1()
+        with open(self.excel_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(block)
+        return h.hexdigest()
+
+    def _read_sheet(self):
+        import openpyxl
+        wb = openpyxl.load_workbook(self.excel_path, read_only=True)
+        try:
+            rows = []
+            for row in wb.active.iter_rows(min_row=2, values_only=True):
+                if len(row) < 4:
+                    continue
+                rows.append((str(row[2] or '').strip(), str(row[3] or '').strip()))
+            return rows
+        finally:
+            wb.close()
+
+    def _load(self, signature):
+        sha1 = None
+        cached = None
+        try:
+            with open(self.cache_path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached.get('version') != ASSISTIDOS_INDEX_VERSION:
+                cached = None
+        except Exception:
+            cached = None
+
+        if cached and cached['signature'] != signature:
+            # Touched/copied but maybe identical: compare content before re-parsing
+            sha1 = self._sha1()
+            if cached['sha1'] != sha1:
+                cached = None
+
+        if cached:
+            rows = cached['rows']
+        else:
+            sys.stderr.write("[Assistidos] Indexando planilha...\n")
+            rows = self._read_sheet()
+        if not cached or cached['signature'] != signature:
+            try:
+                with open(self.cache_path, 'wb') as f:
+                    pickle.dump({'version': ASSISTIDOS_INDEX_VERSION, 'signature': signature,
+                                 'sha1': sha1 or self._sha1(), 'rows': rows}, f)
+            except OSError:
+                pass # Side-car is optional (read-only folder)
+
+        normalized = [(normalize_text(p), normalize_text(a)) for p, a in rows]
+        tokens = sorted(
+            (token, i)
+            for i, (p, a) in enumerate(normalized)
+            for token in set(re.findall(r'\w+', p + ' ' + a))
+        )
+        self.data = (rows, normalized, tokens)
+        self.signature = signature
+
+    def _ensure_current(self):
+        signature = self._signature()
+        if signature != self.signature:
+            with self._lock:
+                if signature != self.signature:
+                    self._load(signature)
+
+    @staticmethod
+    def _prefix_rows(tokens, prefix):
+        start = bisect.bisect_left(tokens, (prefix,))
+        found = set()
+        for token, i in itertools.islice(tokens, start, None):
+            if not token.startswith(prefix):
+                break
+            found.add(i)
+        return found
+
+    def search(self, query: str, limit: int = 10):
+        """
+        Substring matches (in sheet order) first, then rows where every query
+        word is the prefix of some name word (word order/middle names ignored).
+        """
+        self._ensure_current()
+        rows, normalized, tokens = self.data # one consistent snapshot
+        needle = normalize_text(query).strip()
+        if not needle:
+            return []
+
+        matches = [i for i, (p, a) in enumerate(normalized) if needle in p or needle in a][:limit]
+        if len(matches) < limit:
+            words = re.findall(r'\w+', needle)
+            if words:
+                candidates = set.intersection(*(self._prefix_rows(tokens, w) for w in words))
+                seen = set(matches)
+                matches += sorted(candidates - seen)[:limit - len(matches)]
+
+        return [{"assistedName": rows[i][0], "studentName": rows[i][1]} for i in matches]
+
+
+_assistidos_index = AssistidosIndex(ASSISTIDOS_PATH, ASSISTIDOS_INDEX_PATH)
+
+
 def search_assisted_relationship(query: str) -> str:
     """
     Busca na planilha de Assistidos/Pacientes. Use para perguntas como 
@@ -137,30 +585,10 @@ def search_assisted_relationship(query: str) -> str:
         query: Nome do aluno ou assistido para buscar vínculo
     """
     try:
-        import openpyxl
-        excel_path = os.path.join(project_root, 'data', 'LISTA DE ASSISTIDOS.xlsx')
-        
-        if not os.path.exists(excel_path):
+        if not os.path.exists(ASSISTIDOS_PATH):
             return "Lista de assistidos indisponível no momento."
         
-        wb = openpyxl.load_workbook(excel_path, read_only=True)
-        ws = wb.active
-        
-        results = []
-        normalized = query.lower()
-        
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            if len(row) < 4:
-                continue
-            patient = str(row[2] or '').strip()
-            student = str(row[3] or '').strip()
-            
-            if normalized in patient.lower() or normalized in student.lower():
-                results.append({"assistedName": patient, "studentName": student})
-                if len(results) >= 10:
-                    break
-        
-        wb.close()
+        results = _assistidos_index.search(query, limit=10)
         
         if not results:
             return "Nenhum vínculo encontrado."
@@ -178,28 +606,20 @@ def search_knowledge_base(query: str) -> str:
         query: A pergunta específica ou tópicos para buscar nos documentos
     """
     try:
-        import lancedb
-        from sentence_transformers import SentenceTransformer
-        
-        db_path = os.path.join(project_root, 'desktop-app', 'data', 'knowledge.lance')
-        model_cache = os.path.join(project_root, 'desktop-app', 'data', 'models_cache')
-        
-        if not os.path.exists(db_path):
+        if not os.path.exists(get_knowledge_db_path()):
             return "Base de conhecimento não encontrada. Execute o treinamento primeiro."
         
-        db = lancedb.connect(db_path)
-        # Use table_names() for safety (list_tables returns object)
-        if 'documents' not in db.table_names():
-            return "Nenhum documento na base de conhecimento."
-        
-        # Load model
-        model = SentenceTransformer('all-MiniLM-L6-v2', cache_folder=model_cache, local_files_only=True)
-        table = db.open_table('documents')
-        
-        query_vector = model.encode(query)
-        # Debug
-        # sys.stderr.write(f"Querying DB with: {query}\n")
-        results = table.search(query_vector).limit(5).to_list()
+        # Hybrid: vector + BM25 (article numbers, staff names) fused with RRF.
+        # The warm rag_manager daemon answers when running; otherwise search in-process.
+        from rag_manager import query_daemon
+        response = query_daemon({"action": "search", "query": query, "limit": 5, "mode": "hybrid"})
+        if response is not None and response.get("status") == "success":
+            results = response["data"]
+        else:
+            retriever = get_retriever()
+            if retriever.get_table() is None:
+                return "Nenhum documento na base de conhecimento."
+            results = retriever.search(query, limit=5, mode="hybrid")
         
         sys.stderr.write(f"[DEBUG] Found {len(results)} matches for '{query}'\n")
 
@@ -234,6 +654,7 @@ Responda sempre em Português do Brasil.
 DIRETRIZES:
 1. Para 'oi', 'olá', 'tudo bem': responda diretamente.
 2. Para dados de alunos/chamada/assistidos: USE as ferramentas search_students, check_attendance, search_assisted_relationship.
+   - Presença/faltas em um PERÍODO ou de um aluno específico: use attendance_summary (vários alunos) ou student_attendance (um aluno). Datas em AAAA-MM-DD.
 3. Para dúvidas sobre REGRAS, DOCUMENTOS, PRAZOS, FUNCIONAMENTO, COORDENAÇÃO ou ESTRUTURA do NPJ: **VOCÊ DEVE USAR A FERRAMENTA `search_knowledge_base`**.
    - NÃO responda com "consulte a base". Consulte VOCÊ MESMO usando a ferramenta.
    - Se a ferramenta retornar informação, use-a para responder.
@@ -248,6 +669,10 @@ def create_agent():
     if not api_key:
         raise ValueError("GROQ_API_KEY não encontrada no ambiente")
     
+    # Heavy imports (agno, groq, httpx, pydantic) deferred so serve answers ping at once
+    from agno.agent import Agent
+    from agno.models.groq import Groq
+    
     return Agent(
         model=Groq(
             id="llama-3.3-70b-versatile",
@@ -257,6 +682,8 @@ def create_agent():
         tools=[
             search_students,
             check_attendance,
+            attendance_summary,
+            student_attendance,
             search_assisted_relationship,
             search_knowledge_base,
             get_current_time
@@ -266,12 +693,141 @@ def create_agent():
     )
 
 
+# Queries answered at the same time in serve mode (one Groq call each)
+AGENT_CONCURRENCY = int(os.environ.get('VERITAS_AGENT_CONCURRENCY', 0)) or 4
+
+_stdout_lock = threading.Lock()
+
+
+class AgentPool:
+    """Agno agents keep per-run state, so each in-flight query borrows its own."""
+
+    def __init__(self):
+        self._idle = queue.LifoQueue()
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return create_agent()
+
+    def release(self, agent):
+        self._idle.put(agent)
+
+
+def send_response(payload: dict, req_id=None):
+    """Writes one JSON line; the request id (when given) is echoed back."""
+    if req_id is not None:
+        payload = {"id": req_id, **payload}
+    line = json.dumps(payload, ensure_ascii=False)
+    with _stdout_lock:
+        print(line)
+        sys.stdout.flush()
+
+
+def handle_query(agents: AgentPool, req_id, query: str):
+    sys.stderr.write(f"[Agno Agent] Query #{req_id}: {query[:50]}...\n")
+    try:
+        agent = agents.acquire()
+        try:
+            response = agent.run(query)
+        finally:
+            agents.release(agent)
+        content = response.content if hasattr(response, 'content') else str(response)
+        send_response({"status": "success", "data": content}, req_id)
+    except Exception as e:
+        sys.stderr.write(f"[Agno Agent] Error: {e}\n")
+        send_response({"status": "error", "message": str(e)}, req_id)
+
+
+# Nomes de evento do Agno: 1.x usa RunResponse*/ToolCall*, 2.x usa RunContent/ToolCall*
+CONTENT_EVENTS = {"RunResponse", "RunResponseContent", "RunContent"}
+TOOL_START_EVENTS = {"ToolCallStarted"}
+TOOL_END_EVENTS = {"ToolCallCompleted", "ToolCallError"}
+ERROR_EVENTS = {"RunError"}
+
+
+def _event_tool(event):
+    """Nome/argumentos da ferramenta de um evento ToolCall* (1.x: .tools, 2.x: .tool)."""
+    tool = getattr(event, 'tool', None)
+    if tool is None:
+        tools = getattr(event, 'tools', None) or []
+        tool = tools[-1] if tools else None
+    if tool is None:
+        return {}
+    if isinstance(tool, dict):
+        name, args = tool.get('tool_name'), tool.get('tool_args')
+    else:
+        name, args = getattr(tool, 'tool_name', None), getattr(tool, 'tool_args', None)
+    return {"tool": name, "args": args}
+
+
+def _run_stream(agent, query):
+    try:
+        return agent.run(query, stream=True, stream_intermediate_steps=True)
+    except TypeError:
+        # Agno 2.x renomeou stream_intermediate_steps para stream_events
+        return agent.run(query, stream=True, stream_events=True)
+
+
+def handle_query_stream(agents: AgentPool, req_id, query: str):
+    """
+    Streaming variant: emits {"status": "delta", "data": <text>} as tokens
+    arrive, {"status": "tool_start"|"tool_end", ...} around tool calls, and a
+    final {"status": "done", "data": <full answer>}.
+    """
+    sys.stderr.write(f"[Agno Agent] Stream #{req_id}: {query[:50]}...\n")
+    try:
+        agent = agents.acquire()
+        parts = []
+        try:
+            for event in _run_stream(agent, query):
+                kind = getattr(event, 'event', None)
+                if kind in CONTENT_EVENTS:
+                    content = getattr(event, 'content', None)
+                    if isinstance(content, str) and content:
+                        parts.append(content)
+                        send_response({"status": "delta", "data": content}, req_id)
+                elif kind in TOOL_START_EVENTS:
+                    send_response({"status": "tool_start", **_event_tool(event)}, req_id)
+                elif kind in TOOL_END_EVENTS:
+                    send_response({"status": "tool_end", **_event_tool(event)}, req_id)
+                elif kind in ERROR_EVENTS:
+                    raise RuntimeError(getattr(event, 'content', None) or 'Erro no agente de IA.')
+        finally:
+            agents.release(agent)
+        send_response({"status": "done", "data": "".join(parts)}, req_id)
+    except Exception as e:
+        sys.stderr.write(f"[Agno Agent] Error: {e}\n")
+        send_response({"status": "error", "message": str(e)}, req_id)
+
+
 def cmd_serve():
-    """Persistent server mode - reads queries from stdin, writes responses to stdout."""
+    """
+    Persistent server mode - reads JSON lines from stdin, writes responses to stdout.
+    Requests may carry an "id" that is echoed in the response; queries run
+    concurrently (up to AGENT_CONCURRENCY), so replies can arrive out of order.
+    With "stream": true a query answers with delta/tool events and a final "done".
+    """
     sys.stderr.write("[Agno Agent] Starting...\n")
     
-    agent = create_agent()
-    sys.stderr.write("[Agno Agent] Ready. Listening on stdin.\n")
+    agents = AgentPool()
+    ready = threading.Event()
+    
+    def warm_up():
+        # Imports agno/Groq and builds the first agent off the stdin loop
+        try:
+            agents.release(create_agent())
+            sys.stderr.write("[Agno Agent] Warm-up complete.\n")
+        except Exception as e:
+            # e.g. missing GROQ_API_KEY: each query reports it again
+            sys.stderr.write(f"[Agno Agent] Warm-up failed: {e}\n")
+        finally:
+            ready.set()
+    
+    threading.Thread(target=warm_up, name="agent-warmup", daemon=True).start()
+    executor = ThreadPoolExecutor(max_workers=AGENT_CONCURRENCY, thread_name_prefix="agent")
+    sys.stderr.write(f"[Agno Agent] Listening on stdin ({AGENT_CONCURRENCY} concurrent queries, warming up in background).\n")
     
     while True:
         try:
@@ -284,29 +840,21 @@ def cmd_serve():
                 continue
             
             req = json.loads(line)
+            req_id = req.get("id")
             
             if req.get("action") == "query":
-                query = req.get("query", "")
-                sys.stderr.write(f"[Agno Agent] Query: {query[:50]}...\n")
-                
-                try:
-                    response = agent.run(query)
-                    content = response.content if hasattr(response, 'content') else str(response)
-                    print(json.dumps({"status": "success", "data": content}, ensure_ascii=False))
-                except Exception as e:
-                    sys.stderr.write(f"[Agno Agent] Error: {e}\n")
-                    print(json.dumps({"status": "error", "message": str(e)}))
-                
-                sys.stdout.flush()
+                handler = handle_query_stream if req.get("stream") else handle_query
+                executor.submit(handler, agents, req_id, req.get("query", ""))
                 
             elif req.get("action") == "ping":
-                print(json.dumps({"status": "pong"}))
-                sys.stdout.flush()
+                cache = _retriever.cache_stats() if _retriever is not None else None
+                send_response({"status": "pong", "ready": ready.is_set(), "cache": cache}, req_id)
                 
         except Exception as e:
             sys.stderr.write(f"[Agno Agent] Parse Error: {e}\n")
-            print(json.dumps({"status": "error", "message": str(e)}))
-            sys.stdout.flush()
+            send_response({"status": "error", "message": str(e)})
+
+    executor.shutdown(wait=True)
 
 
 def cmd_query(query: str):
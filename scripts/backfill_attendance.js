@@ -0,0 +1,12 @@
+// Reconstrói o rollup diário de presença (attendance_daily) a partir de todo o
+// histórico de activities. Uso: node scripts/backfill_attendance.js
+const db = require('../desktop-app/src/database');
+
+try {
+    console.log('Reconstruindo rollup de presença a partir do histórico...');
+    const rows = db.rebuildAttendanceRollup();
+    console.log(`Rollup reconstruído: ${rows} registros aluno/dia.`);
+} catch (err) {
+    console.error('Backfill failed:', err);
+    process.exit(1);
+}
@@ -1,11 +1,22 @@
 import sys
 import json
 import os
-import lancedb
 import warnings
 import traceback
 import re
-from sentence_transformers import SentenceTransformer
+import gzip
+import hashlib
+import itertools
+import fnmatch
+import zipfile
+import queue
+import threading
+import time
+import secrets
+from datetime import timedelta
+import socket
+import socketserver
+from collections import OrderedDict
 
 # ---------------------------------------------------------
 # SETUP DE IMPORTAÇÃO (PORTABLE/OFFLINE)
@@ -29,28 +40,487 @@ DB_REL_PATH = '../desktop-app/data/knowledge.lance'
 TABLE_NAME = 'documents'
 MODEL_NAME = 'all-MiniLM-L6-v2'
 MODEL_CACHE_REL_PATH = '../desktop-app/data/models_cache'
+# Backend do embedder: 'torch' (padrão), 'onnx' ou 'onnx-int8' (CPU, menor RSS).
+# Valide com: python rag_manager.py check_backend <backend>
+EMBED_BACKEND = os.environ.get('VERITAS_EMBED_BACKEND', 'torch')
+ONNX_QUANTIZATION = 'avx2' # arm64 | avx2 | avx512 | avx512_vnni
+PARITY_MIN_COSINE = 0.99
+# Formatos ingeridos (busca recursiva em source_dir). Filtros opcionais em
+# <source_dir>/.veritas_ingest_config.json: {"include": [globs], "exclude": [globs]};
+# glob sem '/' casa com o nome do arquivo, com '/' com o caminho relativo.
+INGEST_EXTENSIONS = ('.pdf', '.txt', '.md', '.xlsx', '.docx')
+INGEST_CONFIG_NAME = '.veritas_ingest_config.json'
+SCAN_WORKERS = 8
+# Diretórios grandes: os stat() vão para o pool em blocos deste tamanho
+SCAN_STAT_CHUNK = 64
+# PDFs classificados por página: páginas com camada de texto (>= PDF_TEXT_MIN_CHARS
+# caracteres) saem direto do PyPDF; só as páginas-imagem vão para o OCR do Docling,
+# em faixas de até PDF_OCR_PAGES_PER_JOB páginas distribuídas entre os workers.
+PDF_TEXT_MIN_CHARS = 40
+PDF_OCR_PAGES_PER_JOB = 8
+# Planilhas: cabeçalho repetido a cada N linhas para os chunks manterem contexto
+XLSX_ROWS_PER_TABLE = 40
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
+# Processos de extração (Docling/OCR) em paralelo. Sobrescreva com --workers
+# ou VERITAS_INGEST_WORKERS; cada worker usa ~CPU/workers threads do torch.
+EXTRACT_WORKERS = int(os.environ.get('VERITAS_INGEST_WORKERS', 0)) or max(1, (os.cpu_count() or 2) // 4)
+# Cache de extração endereçado por conteúdo (sha256 do arquivo + versão do extrator).
+# Bump EXTRACTOR_VERSION whenever extract_text/chunk_text output changes.
+EXTRACT_CACHE_REL_PATH = '../desktop-app/data/extract_cache'
+EXTRACTOR_VERSION = 'pdf-pages-pypdf-docling-ocr-1'
+EXTRACT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Ingest em streaming: linhas por commit (table.add) e lotes aguardando o writer
+INGEST_BATCH_ROWS = 512
+INGEST_QUEUE_SIZE = 2
+# Tamanho do lote do encoder (chunks de vários documentos são agrupados).
+# Sobrescreva com --batch-size ou VERITAS_EMBED_BATCH_SIZE.
+EMBED_BATCH_SIZE = int(os.environ.get('VERITAS_EMBED_BATCH_SIZE', 0)) or 64
+# Índice vetorial IVF-PQ: criado quando a tabela passa de VECTOR_INDEX_MIN_ROWS
+# linhas e recriado depois de crescer VECTOR_INDEX_REBUILD_GROWTH desde o último build.
+# Abaixo disso a busca exata (flat) é rápida o bastante.
+VECTOR_INDEX_MIN_ROWS = int(os.environ.get('VERITAS_VECTOR_INDEX_MIN_ROWS', 0)) or 10000
+VECTOR_INDEX_REBUILD_GROWTH = 0.2
+INDEX_STATS_REL_PATH = '../desktop-app/data/vector_index_stats.json'
+# Knobs de busca (sobrescritos por request no serve): partições visitadas e
+# re-rank exato de refine_factor * k candidatos (0 = desligado). Sem o re-rank
+# o índice IVF-PQ ordena e pontua por distâncias PQ aproximadas.
+SEARCH_NPROBES = 20
+SEARCH_REFINE_FACTOR = 10
+RECALL_SAMPLE_QUERIES = 50
+# Modo de busca padrão: 'vector', 'fts' (BM25) ou 'hybrid' (ambos + Reciprocal Rank Fusion)
+SEARCH_MODE = 'hybrid'
+RRF_K = 60
+# Índice FTS nativo do Lance: linhas novas ficam fora do índice (a busca as
+# cobre com varredura flat) até passarem de FTS_UNINDEXED_MAX_ROWS, quando o
+# ingest as incorpora incrementalmente em vez de reconstruir o índice inteiro
+FTS_UNINDEXED_MAX_ROWS = 5000
+# Sem índice FTS (ou com erro), busca por LIKE limitada a tantas linhas candidatas
+FTS_FLAT_SCAN_ROWS = 2000
+# Caches do serve/agente (limpos quando o ingest grava uma nova versão da tabela)
+QUERY_VECTOR_CACHE_SIZE = 512
+QUERY_VECTOR_CACHE_TTL = 3600 # seconds
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_TTL = 600 # seconds
+RECALL_NPROBES_SWEEP = (5, 10, 20, 50)
+RECALL_REFINE_SWEEP = (0, SEARCH_REFINE_FACTOR)
+# Versões antigas da tabela mantidas após o ingest (leitores abertos continuam
+# válidos dentro da janela); o resto é compactado/removido por optimize().
+VERSION_RETENTION = timedelta(hours=1)
+# Manutenção automática após o ingest (rag_manager.py maintain) quando a tabela
+# passa de tantos fragmentos ou versões guardadas
+MAINTAIN_FRAGMENT_THRESHOLD = 32
+MAINTAIN_VERSION_THRESHOLD = 50
+# Daemon de busca (rag_manager.py daemon): porta 0 = escolhida pelo SO e
+# publicada, com um token de acesso, em DAEMON_INFO_REL_PATH
+DAEMON_HOST = '127.0.0.1'
+DAEMON_PORT = int(os.environ.get('VERITAS_RAG_PORT', 0))
+DAEMON_INFO_REL_PATH = '../desktop-app/data/rag_daemon.json'
+DAEMON_CONNECT_TIMEOUT = 0.5 # seconds
+DAEMON_REQUEST_TIMEOUT = 30 # seconds
 
 def get_db_path():
     script_dir = os.path.dirname(os.path.abspath(__file__))
     return os.path.join(script_dir, DB_REL_PATH)
 
-def get_model():
+def get_model(backend=None):
+    """
+    Loads the embedder. backend: 'torch' (default), 'onnx' (exported ONNX graph)
+    or 'onnx-int8' (ONNX + dynamic int8 quantization), see EMBED_BACKEND.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    backend = backend or EMBED_BACKEND
     script_dir = os.path.dirname(os.path.abspath(__file__))
     model_path = os.path.join(script_dir, MODEL_CACHE_REL_PATH)
+
+    if backend == 'onnx-int8':
+        return _get_quantized_model(model_path)
+    kwargs = {'backend': 'onnx'} if backend == 'onnx' else {}
     
     # Tenta carregar offline primeiro (mais rápido e sem erro de rede)
     try:
         # Verifica se parece ter algo lá antes de tentar carregar para evitar erro genérico
         if os.path.exists(model_path) and len(os.listdir(model_path)) > 0:
-            return SentenceTransformer(MODEL_NAME, cache_folder=model_path, local_files_only=True)
+            return SentenceTransformer(MODEL_NAME, cache_folder=model_path, local_files_only=True, **kwargs)
     except Exception:
         pass # Fallback to online
 
     # Se falhar ou não existir, baixa (apenas na primeira vez)
     sys.stderr.write(f"[System] Baixando modelo IA para cache local (apenas 1x)...\n")
-    return SentenceTransformer(MODEL_NAME, cache_folder=model_path)
+    return SentenceTransformer(MODEL_NAME, cache_folder=model_path, **kwargs)
+
+def _get_quantized_model(model_path):
+    """
+    ONNX model with dynamic int8 quantization. The quantized graph is exported
+    once into the models cache and loaded from there afterwards.
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    quantized_dir = os.path.join(model_path, f"{MODEL_NAME}-onnx-int8")
+    file_name = f"onnx/model_{ONNX_QUANTIZATION}.onnx"
+    if not os.path.exists(os.path.join(quantized_dir, file_name)):
+        sys.stderr.write(f"[System] Exportando modelo ONNX int8 ({ONNX_QUANTIZATION}) para o cache (apenas 1x)...\n")
+        onnx_model = get_model('onnx')
+        onnx_model.save(quantized_dir)
+        export_dynamic_quantized_onnx_model(onnx_model, ONNX_QUANTIZATION, quantized_dir,
+                                            file_suffix=ONNX_QUANTIZATION)
+    return SentenceTransformer(quantized_dir, backend='onnx', model_kwargs={'file_name': file_name})
+
+def search_vectors(table, query_vector, limit=5, nprobes=None, refine_factor=None):
+    """Vector search with the ANN knobs (ignored by LanceDB while there is no index)."""
+    query = table.search(query_vector).limit(limit).nprobes(nprobes or SEARCH_NPROBES)
+    if refine_factor is None:
+        refine_factor = SEARCH_REFINE_FACTOR
+    if refine_factor:
+        query = query.refine_factor(refine_factor)
+    return query.to_list()
+
+_search_pool = None
+
+def _get_search_pool():
+    global _search_pool
+    if _search_pool is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _search_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag-search")
+    return _search_pool
+
+def search_fts(table, query, limit=5):
+    """
+    BM25 search on the `text` FTS index. Rows not yet indexed are scanned by
+    Lance itself; with no usable index at all it falls back to search_fts_flat.
+    """
+    # Tantivy's query parser rejects stray punctuation (e.g. "art. 5º:")
+    clean_query = re.sub(r'[^\w\s]', ' ', query).strip()
+    if not clean_query:
+        return []
+    try:
+        return table.search(clean_query, query_type="fts").limit(limit).to_list()
+    except Exception as e:
+        sys.stderr.write(f"[Search] FTS index unavailable ({e}), using flat scan.\n")
+    try:
+        return search_fts_flat(table, clean_query, limit)
+    except Exception as e:
+        sys.stderr.write(f"[Search] Flat keyword scan failed: {e}\n")
+        return []
+
+def search_fts_flat(table, clean_query, limit=5):
+    """Keyword fallback without an index: LIKE filter, ranked by term hits (`_score`)."""
+    terms = list(dict.fromkeys(t for t in clean_query.lower().split() if len(t) > 2))[:8]
+    if not terms:
+        return []
+    where = " OR ".join(f"lower(text) LIKE {sql_quote('%' + t + '%')}" for t in terms)
+    rows = table.search().where(where).select(["id", "text", "source"]).limit(FTS_FLAT_SCAN_ROWS).to_list()
+    for r in rows:
+        text = (r.get("text") or "").lower()
+        r["_score"] = float(sum(text.count(t) for t in terms))
+    rows.sort(key=lambda r: r["_score"], reverse=True)
+    return rows[:limit]
+
+def reciprocal_rank_fusion(result_lists, limit, k=RRF_K):
+    """Fuses ranked lists by sum(1 / (k + rank)); rows are matched by id."""
+    fused = {}
+    for results in result_lists:
+        for rank, r in enumerate(results, start=1):
+            key = r.get("id") or r.get("text", "")
+            if key not in fused:
+                fused[key] = {"row": r, "score": 0.0}
+            fused[key]["score"] += 1.0 / (k + rank)
+    ranked = sorted(fused.values(), key=lambda item: item["score"], reverse=True)
+    return [(item["row"], item["score"]) for item in ranked[:limit]]
+
+def search_documents(table, model, query, limit=5, mode=None, nprobes=None, refine_factor=None):
+    """
+    Searches the documents table and returns [{"text", "source", "score"}].
+    score: cosine similarity (vector), BM25 (fts) or RRF score (hybrid).
+    In hybrid mode the vector and FTS searches run in parallel.
+    """
+    mode = mode or SEARCH_MODE
+
+    def vector_leg(n):
+        return search_vectors(table, model.encode(query), n, nprobes, refine_factor)
+
+    if mode == "fts":
+        scored = [(r, r.get("_score", 0)) for r in search_fts(table, query, limit)]
+    elif mode == "hybrid":
+        depth = max(limit * 2, 10)
+        pool = _get_search_pool()
+        vector_future = pool.submit(vector_leg, depth)
+        fts_future = pool.submit(search_fts, table, query, depth)
+        scored = reciprocal_rank_fusion([vector_future.result(), fts_future.result()], limit)
+    else:
+        # L2 distance between unit vectors -> cosine similarity
+        scored = [(r, 1 - r.get("_distance", 0) / 2) for r in vector_leg(limit)]
+
+    return [
+        {"text": r.get("text", ""), "source": r.get("source", "unknown"), "score": round(float(score), 4)}
+        for r, score in scored
+    ]
+
+class TTLCache:
+    """Small thread-safe LRU cache with a per-entry TTL and hit/miss counters."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and time.monotonic() - item[0] > self.ttl:
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def __contains__(self, key):
+        # Lookup without touching the hit/miss counters or the LRU order
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and time.monotonic() - item[0] <= self.ttl
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+def normalize_query(query):
+    return " ".join(query.casefold().split())
+
+class KnowledgeRetriever:
+    """
+    Process-wide search engine: loads the embedder and opens the LanceDB table
+    once (lazily, on first use) and reopens the table only when ingest has
+    committed a new version. Query vectors and results are cached (LRU + TTL);
+    both caches are dropped whenever the table version changes.
+    Safe to share between threads.
+    """
+
+    def __init__(self, db_path=None, backend=None):
+        self.db_path = db_path or get_db_path()
+        self.backend = backend
+        self.version = None
+        self.invalidations = 0
+        self.vector_cache = TTLCache(QUERY_VECTOR_CACHE_SIZE, QUERY_VECTOR_CACHE_TTL)
+        self.result_cache = TTLCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+        self._lock = threading.Lock()
+        self.ready = threading.Event() # set once warm_up() finished
+        self._model = None
+        self._db = None
+        self._table = None
+        self._version_marker = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = get_model(self.backend)
+        return self._model
+
+    def _read_version_marker(self):
+        # Each commit adds a manifest to _versions/, which bumps the folder mtime;
+        # drop/re-create (schema migration) gives a new folder altogether.
+        path = os.path.join(self.db_path, f"{TABLE_NAME}.lance", "_versions")
+        try:
+            st = os.stat(path)
+            return (st.st_ino, st.st_mtime_ns)
+        except OSError:
+            return None
+
+    def get_table(self):
+        """Returns the documents table (None if it does not exist yet)."""
+        marker = self._read_version_marker()
+        with self._lock:
+            if self._table is not None and marker == self._version_marker:
+                return self._table
+            if self._db is None:
+                if not os.path.exists(self.db_path):
+                    return None
+                import lancedb
+                self._db = lancedb.connect(self.db_path)
+            self._table = self._db.open_table(TABLE_NAME) if TABLE_NAME in self._db.table_names() else None
+            self._version_marker = marker
+            new_version = self._table.version if self._table is not None else None
+            if new_version != self.version:
+                if self._table is not None:
+                    sys.stderr.write(f"[RAG] Table '{TABLE_NAME}' opened at version {new_version}.\n")
+                self.vector_cache.clear()
+                self.result_cache.clear()
+                if self.version is not None:
+                    self.invalidations += 1
+            self.version = new_version
+            return self._table
+
+    def encode(self, query):
+        """Query embedding, cached by normalized query text."""
+        key = normalize_query(query)
+        vector = self.vector_cache.get(key)
+        if vector is None:
+            vector = self.model.encode(query)
+            self.vector_cache.put(key, vector)
+        return vector
+
+    def search(self, query, limit=5, mode=None, nprobes=None, refine_factor=None):
+        table = self.get_table()
+        if table is None:
+            return []
+        mode = mode or SEARCH_MODE
+        key = (normalize_query(query), limit, mode, nprobes, refine_factor)
+        results = self.result_cache.get(key)
+        if results is None:
+            # The retriever itself is the "model": its encode() goes through the vector cache
+            results = search_documents(table, self, query, limit, mode, nprobes, refine_factor)
+            self.result_cache.put(key, results)
+        return [dict(r) for r in results]
+
+    def search_many(self, queries, limit=5, mode=None, nprobes=None, refine_factor=None):
+        """
+        Batch version of search(): all uncached queries are encoded in a single
+        model.encode call and their searches run concurrently. Returns one
+        result list per query, in order.
+        """
+        table = self.get_table()
+        if table is None:
+            return [[] for _ in queries]
+
+        mode = mode or SEARCH_MODE
+        missing = []
+        if mode != "fts": # FTS-only never encodes
+            for q in dict.fromkeys(queries):
+                # Only what search() will actually have to encode; `in` keeps the
+                # cache counters for search() itself
+                key = normalize_query(q)
+                if (key, limit, mode, nprobes, refine_factor) not in self.result_cache and key not in self.vector_cache:
+                    missing.append(q)
+        if missing:
+            for q, vector in zip(missing, self.model.encode(missing)):
+                self.vector_cache.put(normalize_query(q), vector)
+
+        from concurrent.futures import ThreadPoolExecutor
+        # Own executor: hybrid searches already use the shared search pool
+        with ThreadPoolExecutor(max_workers=min(8, max(1, len(queries)))) as pool:
+            return list(pool.map(lambda q: self.search(q, limit, mode, nprobes, refine_factor), queries))
+
+    def cache_stats(self):
+        return {
+            "version": self.version,
+            "invalidations": self.invalidations,
+            "query_vectors": self.vector_cache.stats(),
+            "results": self.result_cache.stats()
+        }
+
+def has_vector_index(table):
+    try:
+        return any("vector" in (getattr(idx, "columns", None) or []) for idx in table.list_indices())
+    except Exception:
+        return False
+
+def get_index_stats_path():
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(script_dir, INDEX_STATS_REL_PATH)
+
+def load_index_stats():
+    path = get_index_stats_path()
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+    return {}
+
+def measure_recall(table, k=10, samples=RECALL_SAMPLE_QUERIES, nprobes_sweep=RECALL_NPROBES_SWEEP,
+                   refine_sweep=RECALL_REFINE_SWEEP):
+    """
+    Recall@k of the ANN index against brute force (bypass_vector_index), using
+    stored vectors as queries. Returns one entry per (nprobes, refine_factor)
+    pair to tune with, plus the defaults searches actually use.
+    """
+    import random
+
+    pool = table.search().select(["vector"]).limit(samples * 10).to_list()
+    queries = [r["vector"] for r in random.sample(pool, min(samples, len(pool)))]
+    exact = [
+        {r["id"] for r in table.search(q).limit(k).bypass_vector_index().select(["id"]).to_list()}
+        for q in queries
+    ]
+
+    sweep = []
+    for nprobes, refine_factor in itertools.product(nprobes_sweep, dict.fromkeys(refine_sweep)):
+        hits = 0
+        started = time.perf_counter()
+        for q, truth in zip(queries, exact):
+            found = {r["id"] for r in search_vectors(table, q, k, nprobes, refine_factor)}
+            hits += len(found & truth)
+        elapsed = time.perf_counter() - started
+        sweep.append({
+            "nprobes": nprobes,
+            "refine_factor": refine_factor,
+            "recall_at_k": round(hits / max(1, k * len(queries)), 4),
+            "ms_per_query": round(1000 * elapsed / max(1, len(queries)), 2)
+        })
+    return {"k": k, "queries": len(queries), "sweep": sweep,
+            "defaults": {"nprobes": SEARCH_NPROBES, "refine_factor": SEARCH_REFINE_FACTOR}}
+
+def ensure_vector_index(table, min_rows=VECTOR_INDEX_MIN_ROWS):
+    """
+    Builds (or rebuilds, once the table grew enough) the IVF-PQ index and
+    records its recall in INDEX_STATS_REL_PATH. Rows added after the last build
+    are still found: LanceDB scans unindexed fragments with a flat search.
+    Returns the stats of the build, or None when nothing was done.
+    """
+    rows = table.count_rows()
+    if rows < min_rows:
+        return None
+
+    stats = load_index_stats()
+    if has_vector_index(table) and stats.get("rows") and rows < stats["rows"] * (1 + VECTOR_INDEX_REBUILD_GROWTH):
+        return None
+
+    dim = table.schema.field("vector").type.list_size
+    num_partitions = max(1, int(rows ** 0.5))
+    num_sub_vectors = next(n for n in (dim // 8, dim // 4, dim // 2, 1) if n and dim % n == 0)
+
+    sys.stderr.write(f"[System] Building IVF-PQ index ({rows} rows, {num_partitions} partitions)...\n")
+    started = time.perf_counter()
+    table.create_index(metric="L2", vector_column_name="vector", num_partitions=num_partitions,
+                       num_sub_vectors=num_sub_vectors, replace=True)
+    stats = {
+        "rows": rows,
+        "num_partitions": num_partitions,
+        "num_sub_vectors": num_sub_vectors,
+        "build_seconds": round(time.perf_counter() - started, 2),
+        "built_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    try:
+        stats["recall"] = measure_recall(table)
+    except Exception as e:
+        sys.stderr.write(f"[Warning] Could not measure index recall: {e}\n")
+
+    try:
+        with open(get_index_stats_path(), 'w', encoding='utf-8') as f:
+            json.dump(stats, f, indent=2)
+    except Exception:
+        pass
+    return stats
 
 def get_table(db, create_if_missing=False):
     if TABLE_NAME in db.table_names():
@@ -63,41 +533,151 @@ def get_table(db, create_if_missing=False):
         return None
     return None
 
-def extract_text(file_path):
+# Docling converters cached by pipeline options; lives for the whole ingest run
+# (and for the lifetime of each pool worker).
+_CONVERTERS = {}
+
+def build_pdf_converter(do_ocr=True, do_table_structure=True, table_mode="accurate"):
+    """
+    Builds a Docling converter (default: OCR + ACCURATE TableFormer).
+    Expensive: loads layout/table models from disk, so prefer get_pdf_converter().
+    """
+    from docling.document_converter import DocumentConverter, PdfFormatOption
+    from docling.datamodel.base_models import InputFormat
+    from docling.datamodel.pipeline_options import PdfPipelineOptions, TableFormerMode
+
+    # Configure Docling (OCR enabled)
+    pipeline_options = PdfPipelineOptions()
+    pipeline_options.do_ocr = do_ocr
+    pipeline_options.do_table_structure = do_table_structure
+    pipeline_options.table_structure_options.mode = (
+        TableFormerMode.ACCURATE if table_mode == "accurate" else TableFormerMode.FAST
+    )
+
+    return DocumentConverter(
+        format_options={
+            InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
+        } 
+    )
+
+def warm_up_converter(converter):
+    """Loads the PDF pipeline models now instead of on the first convert()."""
+    try:
+        from docling.datamodel.base_models import InputFormat
+        converter.initialize_pipeline(InputFormat.PDF)
+    except Exception as e:
+        sys.stderr.write(f"  [Docling Warm-up] {e}\n")
+
+def get_pdf_converter(do_ocr=True, do_table_structure=True, table_mode="accurate"):
+    """Returns the cached (and warmed up) converter for these pipeline options."""
+    key = (do_ocr, do_table_structure, table_mode)
+    converter = _CONVERTERS.get(key)
+    if converter is None:
+        converter = build_pdf_converter(do_ocr, do_table_structure, table_mode)
+        warm_up_converter(converter)
+        _CONVERTERS[key] = converter
+    return converter
+
+def classify_pdf_pages(file_path):
+    """
+    Per-page text layer detection with PyPDF. Returns one entry per page:
+    the page text, or None for image-only pages that need OCR.
+    """
+    from pypdf import PdfReader
+
+    pages = []
+    for page in PdfReader(file_path).pages:
+        try:
+            text = page.extract_text() or ""
+        except Exception:
+            text = ""
+        pages.append(text if len(re.sub(r'\s', '', text)) >= PDF_TEXT_MIN_CHARS else None)
+    return pages
+
+def ocr_page_ranges(page_texts, max_pages=PDF_OCR_PAGES_PER_JOB):
+    """Contiguous 1-based (first, last) ranges of the pages that need OCR."""
+    ranges = []
+    for number, text in enumerate(page_texts, start=1):
+        if text is not None:
+            continue
+        if ranges and ranges[-1][1] == number - 1 and number - ranges[-1][0] < max_pages:
+            ranges[-1] = (ranges[-1][0], number)
+        else:
+            ranges.append((number, number))
+    return ranges
+
+def ocr_pdf_pages(file_path, page_range, converter=None):
+    """Docling (OCR) markdown for pages first..last of the PDF."""
+    if converter is None:
+        converter = get_pdf_converter()
+    result = converter.convert(file_path, page_range=page_range)
+    return result.document.export_to_markdown()
+
+def join_pdf_pages(page_texts, ocr_texts):
+    """Merges text-layer pages and OCR'd ranges ({(first, last): text}) in page order."""
+    # Each OCR range goes where its first page was
+    parts_by_page = {n: t for n, t in enumerate(page_texts, start=1) if t is not None}
+    parts_by_page.update({first: text for (first, _), text in ocr_texts.items()})
+    return "\n\n".join(t for _, t in sorted(parts_by_page.items()) if t)
+
+def pdf_method(page_texts):
+    ocr_pages = sum(1 for t in page_texts if t is None)
+    if not ocr_pages:
+        return "pypdf"
+    return "docling_ocr" if ocr_pages == len(page_texts) else "pypdf+docling_ocr"
+
+def extract_pdf_text(file_path, converter=None, page_texts=None):
     """
-    Docling-only extraction strategy (User Request)
+    Text-layer pages via PyPDF, image-only pages via Docling OCR (in this process).
+    page_texts: result of classify_pdf_pages when the caller already has it.
+    Returns (text, method, partial); partial is True when an OCR range failed.
+    """
+    if page_texts is None:
+        try:
+            page_texts = classify_pdf_pages(file_path)
+        except Exception as e:
+            # Unreadable for PyPDF (encrypted, broken xref...): whole document through Docling
+            sys.stderr.write(f"  [PyPDF] {e}; using Docling for the whole file\n")
+            if converter is None:
+                converter = get_pdf_converter()
+            return converter.convert(file_path).document.export_to_markdown(), "docling", False
+
+    ocr_texts = {}
+    partial = False
+    for page_range in ocr_page_ranges(page_texts):
+        try:
+            ocr_texts[page_range] = ocr_pdf_pages(file_path, page_range, converter)
+        except Exception as e:
+            sys.stderr.write(f"  [Docling Error] pages {page_range[0]}-{page_range[1]}: {e}\n")
+            partial = True
+    return join_pdf_pages(page_texts, ocr_texts), pdf_method(page_texts), partial
+
+def clean_text(text):
+    # Fix spaces
+    return re.sub(r'  +', ' ', text)
+
+def extract_text(file_path, converter=None, page_texts=None):
+    """
+    Extraction strategy per format. PDFs are classified page by page
+    (extract_pdf_text); Docling uses the cached converter unless one is passed.
+    Returns (text, method, partial): partial means some PDF pages failed OCR,
+    so the text must not be cached or the file recorded as ingested.
     """
     ext = os.path.splitext(file_path)[1].lower()
     full_text = ""
     used_method = "unknown"
+    partial = False
 
-    # Strategy: Docling for PDF (Primary)
+    # Strategy: PyPDF text layer + Docling OCR for image-only pages
     if ext == '.pdf':
         try:
-            from docling.document_converter import DocumentConverter, PdfFormatOption
-            from docling.datamodel.base_models import InputFormat
-            from docling.datamodel.pipeline_options import PdfPipelineOptions, TableFormerMode
-
-            # Configure Docling (OCR enabled)
-            pipeline_options = PdfPipelineOptions()
-            pipeline_options.do_ocr = True 
-            pipeline_options.do_table_structure = True
-            pipeline_options.table_structure_options.mode = TableFormerMode.ACCURATE
-
-            converter = DocumentConverter(
-                format_options={
-                    InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
-                } 
-            )
-            result = converter.convert(file_path)
-            full_text = result.document.export_to_markdown()
-            used_method = "docling"
+            full_text, used_method, partial = extract_pdf_text(file_path, converter, page_texts)
         except Exception as e:
-             sys.stderr.write(f"  [Docling Error] {e}\n")
-             used_method = "docling_error"
+             sys.stderr.write(f"  [PDF Error] {e}\n")
+             used_method = "pdf_error"
 
     # Strategy: Text Files
-    elif ext == '.txt':
+    elif ext in ('.txt', '.md'):
         try:
             with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
                 full_text = f.read()
@@ -105,20 +685,204 @@ def extract_text(file_path):
         except Exception:
              used_method = "txt_error"
     
-    # Strategy: Excel
+    # Strategy: Excel (sheets as markdown tables)
     elif ext == '.xlsx':
-         # (Simple export handled by other tools or skipped here, assume text extraction needed?)
-         # For now, skipping complex excel parsing inside RAG unless needed.
-         pass
+        try:
+            full_text = extract_xlsx_text(file_path)
+            used_method = "xlsx_openpyxl"
+        except Exception as e:
+            sys.stderr.write(f"  [Excel Error] {e}\n")
+            used_method = "xlsx_error"
+
+    # Strategy: Word (paragraphs + tables, straight from the XML)
+    elif ext == '.docx':
+        try:
+            full_text = extract_docx_text(file_path)
+            used_method = "docx_xml"
+        except Exception as e:
+            sys.stderr.write(f"  [Word Error] {e}\n")
+            used_method = "docx_error"
 
     if not full_text:
-        return None, "no_text"
+        return None, "no_text", partial
     
     # Cleaning
-    # Fix spaces
-    full_text = re.sub(r'  +', ' ', full_text)
-    
-    return full_text, used_method
+    return clean_text(full_text), used_method, partial
+
+def _cell_str(value):
+    if value is None:
+        return ""
+    if hasattr(value, "strftime"):
+        return value.strftime("%d/%m/%Y %H:%M" if getattr(value, "hour", 0) or getattr(value, "minute", 0) else "%d/%m/%Y")
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).replace("|", "\\|").replace("\n", " ").strip()
+
+def rows_to_markdown(rows):
+    """Markdown table; the first row is the header."""
+    width = max(len(r) for r in rows)
+    cells = [list(r) + [""] * (width - len(r)) for r in rows]
+    lines = ["| " + " | ".join(cells[0]) + " |", "|" + " --- |" * width]
+    lines += ["| " + " | ".join(r) + " |" for r in cells[1:]]
+    return "\n".join(lines)
+
+def extract_xlsx_text(file_path):
+    """
+    Streams every sheet with openpyxl read_only (rows are not kept in memory
+    by openpyxl) and renders them as markdown tables, repeating the header
+    every XLSX_ROWS_PER_TABLE rows.
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    parts = []
+    try:
+        for ws in wb.worksheets:
+            header = None
+            block = []
+            sections = []
+            for row in ws.iter_rows(values_only=True):
+                values = [_cell_str(v) for v in row]
+                while values and not values[-1]:
+                    values.pop()
+                if not values:
+                    continue
+                if header is None:
+                    header = values
+                    continue
+                block.append(values)
+                if len(block) >= XLSX_ROWS_PER_TABLE:
+                    sections.append(rows_to_markdown([header] + block))
+                    block = []
+            if header is None:
+                continue
+            if block or not sections:
+                sections.append(rows_to_markdown([header] + block))
+            parts.append(f"## {ws.title}\n\n" + "\n\n".join(sections))
+    finally:
+        wb.close()
+    return "\n\n".join(parts)
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+def extract_docx_text(file_path):
+    """
+    Reads word/document.xml incrementally (iterparse, elements cleared as
+    they are consumed): paragraphs become lines, top-level tables markdown
+    tables; nested tables are flattened into their cell.
+    """
+    import xml.etree.ElementTree as ET
+
+    lines = []
+    para, cell, row, rows = [], [], [], []
+    table_depth = 0
+    with zipfile.ZipFile(file_path) as z, z.open('word/document.xml') as f:
+        for event, el in ET.iterparse(f, events=('start', 'end')):
+            tag = el.tag
+            if event == 'start':
+                if tag == _W + 'tbl':
+                    table_depth += 1
+                continue
+            if tag == _W + 't':
+                para.append(el.text or '')
+            elif tag == _W + 'tab':
+                para.append(' ')
+            elif tag in (_W + 'br', _W + 'cr'):
+                para.append('\n')
+            elif tag == _W + 'p':
+                text = ''.join(para).strip()
+                para = []
+                if text:
+                    (cell if table_depth else lines).append(text)
+            elif tag == _W + 'tc' and table_depth == 1:
+                row.append(' '.join(cell).replace('|', '\\|').replace('\n', ' '))
+                cell = []
+            elif tag == _W + 'tr' and table_depth == 1:
+                if any(row):
+                    rows.append(row)
+                row = []
+            elif tag == _W + 'tbl':
+                table_depth -= 1
+                if table_depth == 0 and rows:
+                    lines.append(rows_to_markdown(rows))
+                    rows = []
+            el.clear()
+    return "\n\n".join(lines)
+
+def load_ingest_config(source_dir):
+    path = os.path.join(source_dir, INGEST_CONFIG_NAME)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        config = {}
+    return {"include": config.get("include") or [], "exclude": config.get("exclude") or []}
+
+def _glob_match(rel_path, patterns):
+    name = rel_path.rstrip('/').rsplit('/', 1)[-1]
+    return any(fnmatch.fnmatch(rel_path if '/' in p else name, p) for p in patterns)
+
+def scan_source_dir(source_dir, config=None, workers=SCAN_WORKERS):
+    """
+    Recursive os.scandir walk on a thread pool: each directory is listed by one
+    task, and directories with more than SCAN_STAT_CHUNK candidate files have
+    their stat() calls split into chunks submitted to the same pool. Returns {relative path ('/' separators): os.stat_result}
+    for the ingestible files, so change detection needs no second stat.
+    Hidden entries and Office lock files (~$*) are skipped.
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    config = config or load_ingest_config(source_dir)
+    include, exclude = config["include"], config["exclude"]
+
+    def stat_files(candidates):
+        files = []
+        for rel, entry in candidates:
+            try:
+                files.append((rel, entry.stat()))
+            except OSError as e:
+                sys.stderr.write(f"  [Scan] Skipping {rel}: {e}\n")
+        return files, [], []
+
+    def scan_dir(path):
+        candidates, dirs = [], []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith(('.', '~$')):
+                    continue
+                rel = os.path.relpath(entry.path, source_dir).replace(os.sep, '/')
+                try:
+                    if entry.is_dir():
+                        if not (_glob_match(rel, exclude) or _glob_match(rel + '/', exclude)):
+                            dirs.append(entry.path)
+                        continue
+                    if not entry.is_file() or not entry.name.lower().endswith(INGEST_EXTENSIONS):
+                        continue
+                    if (include and not _glob_match(rel, include)) or _glob_match(rel, exclude):
+                        continue
+                    candidates.append((rel, entry))
+                except OSError as e:
+                    sys.stderr.write(f"  [Scan] Skipping {rel}: {e}\n")
+        if len(candidates) <= SCAN_STAT_CHUNK:
+            return stat_files(candidates)[0], dirs, []
+        return [], dirs, candidates
+
+    found = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan") as pool:
+        pending = {pool.submit(scan_dir, source_dir)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    files, dirs, candidates = future.result()
+                except OSError as e:
+                    sys.stderr.write(f"  [Scan] {e}\n")
+                    continue
+                found.update(files)
+                pending.update(pool.submit(scan_dir, d) for d in dirs)
+                pending.update(pool.submit(stat_files, candidates[i:i + SCAN_STAT_CHUNK])
+                               for i in range(0, len(candidates), SCAN_STAT_CHUNK))
+    return found
 
 def chunk_text(text):
     from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -129,6 +893,444 @@ def chunk_text(text):
     )
     return text_splitter.split_text(text)
 
+# ---------------------------------------------------------
+# POOL DE EXTRAÇÃO (multi-processo)
+# Cada worker monta (e aquece) o DocumentConverter uma única vez no
+# initializer e o reutiliza para todos os arquivos que receber.
+# ---------------------------------------------------------
+def _init_extract_worker(threads_per_worker, warm_up):
+    # Avoid N workers x all cores of torch/OpenMP threads fighting each other
+    os.environ["OMP_NUM_THREADS"] = str(threads_per_worker)
+    try:
+        import torch
+        torch.set_num_threads(threads_per_worker)
+    except Exception:
+        pass
+    if warm_up:
+        try:
+            get_pdf_converter()
+        except Exception as e:
+            sys.stderr.write(f"  [Docling Warm-up] {e}\n")
+
+def _extract_job(file_path, split_ocr=False):
+    """
+    Runs inside a pool worker: extract + chunk one file.
+    Returns (file_path, text, method, chunks, error, partial). With split_ocr,
+    a PDF with more than one OCR range comes back as (file_path, None,
+    "split", (page_texts, ranges), None, False) so its ranges can be spread
+    over the pool.
+    """
+    try:
+        page_texts = None
+        if split_ocr and file_path.lower().endswith('.pdf'):
+            try:
+                page_texts = classify_pdf_pages(file_path)
+            except Exception:
+                page_texts = None # extract_text falls back to whole-file Docling
+            if page_texts is not None:
+                ranges = ocr_page_ranges(page_texts)
+                if len(ranges) > 1:
+                    return file_path, None, "split", (page_texts, ranges), None, False
+        # The PDF was already classified above: no second PyPDF pass
+        text, method, partial = extract_text(file_path, page_texts=page_texts)
+        chunks = chunk_text(text) if text else []
+        return file_path, text, method, chunks, None, partial
+    except Exception as e:
+        return file_path, None, "error", [], str(e), False
+
+def _ocr_job(file_path, page_range):
+    """Runs inside a pool worker: OCR one page range of a PDF."""
+    try:
+        return file_path, page_range, ocr_pdf_pages(file_path, page_range), None
+    except Exception as e:
+        return file_path, page_range, None, str(e)
+
+def iter_extracted(file_paths, workers=EXTRACT_WORKERS):
+    """
+    Yields (file_path, text, method, chunks, error, partial) as each file finishes,
+    so embedding can start before the slowest document is done. At most
+    2x workers jobs are in flight, so finished results never pile up.
+    PDFs with several image-only page ranges are OCR'd range by range in
+    parallel (ahead of new files) and reassembled here.
+    """
+    if not any(fp.lower().endswith('.pdf') for fp in file_paths):
+        workers = min(workers, len(file_paths)) # PDFs may still fan out per page range
+    workers = max(1, workers)
+    if workers == 1:
+        # No pool overhead for a single file / single worker
+        for file_path in file_paths:
+            yield _extract_job(file_path)
+        return
+
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    # Docling models load lazily, on a worker's first OCR page: most PDFs never need them
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_extract_worker,
+                             initargs=(threads_per_worker, False)) as pool:
+        jobs = deque((_extract_job, (fp, True)) for fp in file_paths)
+        split = {} # file_path -> [page_texts, {range: text}, ranges left, any range failed]
+        in_flight = set()
+        while jobs or in_flight:
+            while jobs and len(in_flight) < workers * 2:
+                fn, args = jobs.popleft()
+                in_flight.add(pool.submit(fn, *args))
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                result = fut.result()
+                if len(result) == 6 and result[2] != "split":
+                    yield result
+                    continue
+                if len(result) == 6:
+                    file_path, _, _, (page_texts, ranges), _, _ = result
+                    split[file_path] = [page_texts, {}, len(ranges), False]
+                    # OCR ranges of a started file go before new files
+                    jobs.extendleft((_ocr_job, (file_path, r)) for r in reversed(ranges))
+                    continue
+                file_path, page_range, text, error = result
+                state = split[file_path]
+                if error:
+                    sys.stderr.write(f"  [Docling Error] {os.path.basename(file_path)} pages {page_range[0]}-{page_range[1]}: {error}\n")
+                    state[3] = True
+                else:
+                    state[1][page_range] = text
+                state[2] -= 1
+                if state[2] == 0:
+                    page_texts, ocr_texts, _, partial = split.pop(file_path)
+                    text = clean_text(join_pdf_pages(page_texts, ocr_texts))
+                    yield (file_path, text or None, pdf_method(page_texts),
+                           chunk_text(text) if text else [], None, partial)
+
+def file_sha256(file_path):
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+class ExtractionCache:
+    """
+    On-disk cache of extracted markdown + chunks, keyed by content hash and
+    extractor version. Entries are gzip'd JSON; LRU order is the file mtime
+    (refreshed on every hit) and the oldest entries are evicted once the
+    folder grows past `max_bytes`.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=EXTRACT_CACHE_MAX_BYTES):
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), EXTRACT_CACHE_REL_PATH)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.version_key = f"{EXTRACTOR_VERSION}-c{CHUNK_SIZE}o{CHUNK_OVERLAP}"
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.{self.version_key}.json.gz")
+
+    def has(self, digest):
+        return os.path.exists(self._path(digest))
+
+    def get(self, digest):
+        path = self._path(digest)
+        if not os.path.exists(path):
+            return None
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path, None) # Mark as recently used
+            return entry
+        except Exception:
+            return None
+
+    def put(self, digest, text, method, chunks):
+        path = self._path(digest)
+        tmp_path = path + '.tmp'
+        try:
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                json.dump({"text": text, "method": method, "chunks": chunks}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            sys.stderr.write(f"  [Cache] Could not store extraction: {e}\n")
+
+    def evict(self):
+        """Drops least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file():
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        entries.sort()
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+def embed_texts(model, texts, batch_size=EMBED_BATCH_SIZE):
+    """
+    Encodes `texts` in fixed-size batches after sorting them by length, so each
+    batch pads to similar lengths. Returns the vectors in the original order.
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    vectors = [None] * len(texts)
+    for start in range(0, len(order), batch_size):
+        idx = order[start:start + batch_size]
+        encoded = model.encode([texts[i] for i in idx], batch_size=batch_size)
+        for i, vector in zip(idx, encoded):
+            vectors[i] = vector
+    return vectors
+
+def chunk_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def sql_quote(value):
+    """SQL string literal for a LanceDB filter (file names may contain quotes)."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+def source_filter(sources):
+    """`source IN (...)` predicate covering every file in `sources`."""
+    return f"source IN ({', '.join(sql_quote(s) for s in sources)})"
+
+def load_chunk_vectors(table, source):
+    """Returns {chunk_hash: vector} for the rows currently stored for `source`."""
+    try:
+        where = f"source = {sql_quote(source)}"
+        n = table.count_rows(where)
+        if not n:
+            return {}
+        rows = table.search().where(where).select(["chunk_hash", "vector"]).limit(n).to_list()
+        return {r["chunk_hash"]: r["vector"] for r in rows if r.get("chunk_hash")}
+    except Exception as e:
+        sys.stderr.write(f"  [Warn] Could not load previous vectors for {source}: {e}\n")
+        return {}
+
+class BatchWriter(threading.Thread):
+    """
+    Last stage of the ingest pipeline. Takes batches of whole documents from
+    a bounded queue, replaces their rows in LanceDB with a single commit per
+    batch (merge_insert on `id`) and only then records those files in the
+    ingest metadata, so an interrupted run resumes after the last committed batch.
+    """
+
+    def __init__(self, db, metadata, source_dir, queue_size=INGEST_QUEUE_SIZE):
+        super().__init__(daemon=True)
+        self.db = db
+        self.metadata = metadata
+        self.source_dir = source_dir
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.rows_written = 0
+
+    def submit(self, rows, replace_sources, files, forget=()):
+        """
+        Blocks while the queue is full (back-pressure on embedding).
+        replace_sources: files whose stored rows are replaced by `rows`
+        (or dropped, when they have none); forget: files removed from metadata.
+        """
+        if self.error:
+            raise self.error
+        self.queue.put((rows, replace_sources, files, forget))
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+        if self.error:
+            raise self.error
+
+    def run(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            if self.error:
+                continue # Drain so producers never block on a dead writer
+            try:
+                self._commit(*batch)
+            except Exception as e:
+                self.error = e
+
+    def _commit(self, rows, replace_sources, files, forget):
+        table = self.db.open_table(TABLE_NAME) if TABLE_NAME in self.db.table_names() else None
+        if table is None:
+            if rows:
+                self.db.create_table(TABLE_NAME, data=rows)
+        elif rows:
+            # Upsert on the deterministic ids + delete of leftover rows of every
+            # file in the batch: one table version, and re-committing a batch
+            # after a crash (before its metadata was saved) never duplicates rows
+            sources = list(dict.fromkeys(list(replace_sources) + [r["source"] for r in rows]))
+            (table.merge_insert("id")
+                .when_matched_update_all()
+                .when_not_matched_insert_all()
+                .when_not_matched_by_source_delete(source_filter(sources))
+                .execute(rows))
+        elif replace_sources:
+            table.delete(source_filter(replace_sources))
+        self.rows_written += len(rows)
+        self.metadata.update(files)
+        for f in forget:
+            self.metadata.pop(f, None)
+        save_metadata(self.metadata, self.source_dir)
+
+def optimize_table(table, retention=VERSION_RETENTION):
+    """
+    Compacts small fragments, folds deletions into the data files, updates
+    the indices and drops table versions older than `retention`.
+    """
+    try:
+        started = time.perf_counter()
+        if hasattr(table, "optimize"):
+            table.optimize(cleanup_older_than=retention)
+        else: # lancedb < 0.8
+            table.compact_files()
+            table.cleanup_old_versions(retention)
+        sys.stderr.write(f"[System] Table optimized in {time.perf_counter() - started:.1f}s (version {table.version}).\n")
+    except Exception as e:
+        sys.stderr.write(f"[Warning] Could not optimize table: {e}\n")
+
+def table_health(table, db_path):
+    """Fragments, stored versions, rows and on-disk bytes (all versions) of the table."""
+    health = {"rows": table.count_rows(), "fragments": None, "versions": None, "bytes": 0}
+    try:
+        health["fragments"] = table.stats()["fragment_stats"]["num_fragments"]
+    except Exception:
+        try:
+            health["fragments"] = len(table.to_lance().get_fragments())
+        except Exception:
+            pass
+    try:
+        health["versions"] = len(table.list_versions())
+    except Exception:
+        pass
+    for root, _, names in os.walk(os.path.join(db_path, f"{TABLE_NAME}.lance")):
+        for name in names:
+            try:
+                health["bytes"] += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return health
+
+def fts_index_name(table):
+    """Name of the native FTS index on `text` (None if missing or legacy tantivy)."""
+    try:
+        for idx in table.list_indices():
+            if str(getattr(idx, "index_type", "")).upper() == "FTS":
+                return idx.name
+    except Exception:
+        pass
+    return None
+
+def has_fts_index(table):
+    return fts_index_name(table) is not None
+
+def build_fts_index(table):
+    try:
+        table.create_fts_index("text", use_tantivy=False, replace=True)
+    except TypeError: # lancedb without native FTS
+        table.create_fts_index("text", replace=True)
+
+def fts_unindexed_rows(table, name):
+    stats = table.index_stats(name)
+    if isinstance(stats, dict):
+        return stats.get("num_unindexed_rows", 0)
+    return getattr(stats, "num_unindexed_rows", 0)
+
+def update_fts_index(table):
+    """
+    Keeps the FTS index current without rebuilding it every ingest: builds it
+    once, then leaves new rows to the flat scan until FTS_UNINDEXED_MAX_ROWS
+    and only then merges them into the existing index. Returns what was done.
+    """
+    name = fts_index_name(table)
+    if name is None:
+        build_fts_index(table)
+        return "built"
+    unindexed = fts_unindexed_rows(table, name)
+    if unindexed < FTS_UNINDEXED_MAX_ROWS:
+        return f"deferred ({unindexed} unindexed rows)"
+    try:
+        table.to_lance().optimize.optimize_indices(index_names=[name])
+    except Exception:
+        # No pylance handle: optimize() also folds new rows into the indices
+        optimize_table(table)
+    return f"incremental ({unindexed} rows added)"
+
+def maintain_table(table, db_path, retention=VERSION_RETENTION, reindex=False):
+    """
+    Compacts fragments, prunes versions older than `retention` and rebuilds
+    indices when needed (missing FTS index, IVF-PQ past its growth threshold,
+    or everything with reindex=True). Returns before/after health stats.
+    """
+    before = table_health(table, db_path)
+    started = time.perf_counter()
+
+    optimize_table(table, retention)
+
+    rebuilt = []
+    try:
+        if reindex or not has_fts_index(table):
+            build_fts_index(table)
+            rebuilt.append("fts")
+    except Exception as e:
+        sys.stderr.write(f"[Warning] Could not rebuild FTS index: {e}\n")
+    try:
+        if reindex and has_vector_index(table):
+            # Drop the recorded build so ensure_vector_index rebuilds it now
+            with open(get_index_stats_path(), 'w', encoding='utf-8') as f:
+                json.dump({}, f)
+        if ensure_vector_index(table):
+            rebuilt.append("vector")
+    except Exception as e:
+        sys.stderr.write(f"[Warning] Could not rebuild vector index: {e}\n")
+    if rebuilt:
+        # Index builds add versions of their own; prune them as well
+        optimize_table(table, retention)
+
+    after = table_health(table, db_path)
+    return {
+        "before": before,
+        "after": after,
+        "rebuilt_indices": rebuilt,
+        "seconds": round(time.perf_counter() - started, 1),
+    }
+
+def maybe_maintain(table, db_path):
+    """Runs maintain_table after ingest once fragments/versions pass their thresholds."""
+    health = table_health(table, db_path)
+    if (health["fragments"] or 0) < MAINTAIN_FRAGMENT_THRESHOLD and (health["versions"] or 0) < MAINTAIN_VERSION_THRESHOLD:
+        return None
+    sys.stderr.write(f"[System] {health['fragments']} fragments / {health['versions']} versions: running maintenance...\n")
+    return maintain_table(table, db_path)
+
+def cmd_maintain(retention_hours=None, reindex=False):
+    """Compacts the table, prunes old versions and reports before/after sizes."""
+    import lancedb
+    db_path = get_db_path()
+    if not os.path.exists(db_path):
+        print(json.dumps({"status": "error", "message": f"Database not found at {db_path}"}))
+        return
+    db = lancedb.connect(db_path)
+    if TABLE_NAME not in db.table_names():
+        print(json.dumps({"status": "success", "message": "No table to maintain."}))
+        return
+
+    retention = VERSION_RETENTION if retention_hours is None else timedelta(hours=retention_hours)
+    report = maintain_table(db.open_table(TABLE_NAME), db_path, retention, reindex)
+    before, after = report["before"], report["after"]
+    sys.stderr.write(f"[System] Fragments {before['fragments']} -> {after['fragments']}, "
+                     f"versions {before['versions']} -> {after['versions']}, "
+                     f"{before['bytes'] / 1e6:.1f} MB -> {after['bytes'] / 1e6:.1f} MB\n")
+    print(json.dumps({"status": "success", **report}))
+
 def get_metadata_path(source_dir):
     # Metadata file INSIDE the source directory (portability)
     return os.path.join(source_dir, '.veritas_ingest_metadata.json')
@@ -144,62 +1346,103 @@ def load_metadata(source_dir):
     return {}
 
 def save_metadata(metadata, source_dir):
+    # Atomic replace: a run killed mid-write must not leave a truncated file
+    # (load_metadata would return {} and every file would be re-ingested)
     path = get_metadata_path(source_dir)
+    tmp_path = path + '.tmp'
     try:
-        with open(path, 'w', encoding='utf-8') as f:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(metadata, f, ensure_ascii=False, indent=2)
-    except:
-        pass
+        os.replace(tmp_path, path)
+    except OSError as e:
+        sys.stderr.write(f"[Warning] Could not save ingest metadata: {e}\n")
 
-def cmd_ingest(source_dir):
+def diff_source_files(source_dir, scanned, metadata):
+    """
+    Compares the scan against the ingest metadata.
+    metadata[f] = {"mtime": ..., "sha256": ...} (older runs stored just the mtime).
+    Returns (files_to_process, file_hashes, skipped_count, touched_only); entries
+    whose mtime changed but bytes did not are refreshed in `metadata` in place.
+    """
+    files_to_process = []
+    file_hashes = {}
+    skipped_count = 0
+    touched_only = False
+    for f in sorted(scanned):
+        full_path = os.path.join(source_dir, f)
+        mtime = scanned[f].st_mtime
+        
+        prev = metadata.get(f)
+        prev_mtime = prev.get("mtime") if isinstance(prev, dict) else prev
+
+        # Check if already ingested and unchanged
+        if f in metadata and prev_mtime == mtime:
+             skipped_count += 1
+             sys.stderr.write(f"Skipping {f} (Unchanged)\n")
+             continue
+
+        # mtime changed: only re-process if the bytes changed too (touch/copy/restore)
+        digest = file_sha256(full_path)
+        if isinstance(prev, dict) and prev.get("sha256") == digest:
+             metadata[f] = {"mtime": mtime, "sha256": digest}
+             touched_only = True
+             skipped_count += 1
+             sys.stderr.write(f"Skipping {f} (Same content)\n")
+             continue
+        
+        file_hashes[f] = digest
+        files_to_process.append(f)
+    return files_to_process, file_hashes, skipped_count, touched_only
+
+def cmd_ingest(source_dir, workers=None, batch_size=None, index_min_rows=None):
     sys.stderr.write(f"--- Ingesting from {source_dir} ---\n")
     if not os.path.exists(source_dir):
         print(json.dumps({"status": "error", "message": "Source directory not found"}))
         return
 
-    db_path = get_db_path()
-    db = lancedb.connect(db_path)
-    model = get_model()
-    
     # Load previous ingestion state FROM source_dir
     metadata = load_metadata(source_dir)
+
+    # Recursive scan; keys are paths relative to source_dir ('/' separators)
+    scanned = scan_source_dir(source_dir)
+    files = sorted(scanned)
+    sys.stderr.write(f"[System] {len(files)} file(s) found in {source_dir}.\n")
     
-    # Check for schema compatibility (Migration to schema with 'id')
+    processed_count = 0
+    embedded_count = 0
+    reused_count = 0
+    errors = []
+
+    # Change detection runs before lancedb is imported: a run with nothing
+    # to do never loads it
+    current_files = {f: scanned[f].st_mtime for f in files}
+    files_to_process, file_hashes, skipped_count, touched_only = diff_source_files(source_dir, scanned, metadata)
+    deleted_files = [f for f in metadata if f not in current_files]
+
+    if not files_to_process and not deleted_files:
+        if touched_only:
+            save_metadata(metadata, source_dir)
+        print(json.dumps({"status": "success", "message": "No changes detected.", "count": 0, "skipped": skipped_count}))
+        return
+
+    import lancedb
+    db_path = get_db_path()
+    db = lancedb.connect(db_path)
+    
+    # Check for schema compatibility (Migration to schema with 'id' and 'chunk_hash')
+    # Re-ingest after a migration hits the extraction cache, so it only re-embeds.
     if TABLE_NAME in db.table_names():
         try:
             t = db.open_table(TABLE_NAME)
-            if 'id' not in t.schema.names:
-                sys.stderr.write("[System] Migrating database schema (adding IDs). Full re-ingest required.\n")
+            if 'id' not in t.schema.names or 'chunk_hash' not in t.schema.names:
+                sys.stderr.write("[System] Migrating database schema (adding IDs/chunk hashes). Full re-ingest required.\n")
                 db.drop_table(TABLE_NAME)
                 metadata = {} # Clear metadata to force re-processing of all files
+                files_to_process, file_hashes, skipped_count, touched_only = diff_source_files(source_dir, scanned, metadata)
+                deleted_files = []
         except Exception as e:
             sys.stderr.write(f"[System] Warning checking schema: {e}\n")
 
-    current_files = {} # To track what currently exists
-    
-    files = [f for f in os.listdir(source_dir) if os.path.isfile(os.path.join(source_dir, f)) and not f.startswith('.')]
-    
-    data_to_insert = []
-    
-    processed_count = 0
-    skipped_count = 0
-    errors = []
-
-    # Identify files to process
-    files_to_process = []
-    for f in files:
-        full_path = os.path.join(source_dir, f)
-        mtime = os.path.getmtime(full_path)
-        current_files[f] = mtime
-        
-        # Check if already ingested and unchanged
-        if f in metadata and metadata[f] == mtime:
-             skipped_count += 1
-             sys.stderr.write(f"Skipping {f} (Unchanged)\n")
-             continue
-        
-        files_to_process.append(f)
-
     # Clean up DB for deleted files or changed files
     # LanceDB doesn't support simple delete by filename efficiently without rewriting usually,
     # but we can try to delete where source = filename.
@@ -235,103 +1478,260 @@ def cmd_ingest(source_dir):
     if TABLE_NAME in db.table_names():
         table = db.open_table(TABLE_NAME)
 
-    # Handle Deletions (Files in metadata but not in current folder)
-    deleted_files = [f for f in metadata if f not in current_files]
-    if table and deleted_files:
+    # Handle Deletions (Files in metadata but not in current folder): deleted_files above
+
+    if deleted_files and not files_to_process:
+        # Nothing to write: one `source IN (...)` delete for the whole run
         sys.stderr.write(f"Removing {len(deleted_files)} deleted files from DB...\n")
         try:
-             # Construct delete query
-             # table.delete(where="source IN ...") might be complex. loop.
-             for df in deleted_files:
-                 table.delete(f"source = '{df}'")
-                 del metadata[df]
+            if table is not None:
+                table.delete(source_filter(deleted_files))
+            for df in deleted_files:
+                del metadata[df]
+            save_metadata(metadata, source_dir)
         except Exception as e:
             sys.stderr.write(f"Warning: Could not delete from DB: {e}. Re-creating table might be needed eventually.\n")
-
-    if not files_to_process and not deleted_files:
-        print(json.dumps({"status": "success", "message": "No changes detected.", "count": 0, "skipped": skipped_count}))
+        maintenance = maybe_maintain(table, db_path) if table is not None else None
+        print(json.dumps({"status": "success", "count": 0, "skipped": skipped_count, "deleted": len(deleted_files),
+                          "maintenance": maintenance, "errors": []}))
         return
 
-    # Process New/Changed
+    # Process New/Changed as a streaming pipeline:
+    #   extraction pool -> chunk (in worker) -> embed -> BatchWriter (bounded queue)
+    # Content already extracted before (same sha256) comes from the cache.
+    # Old rows of a changed file are replaced in the same batch that writes
+    # its new rows; their vectors are reused by chunk hash.
     from tqdm import tqdm
-    pbar = tqdm(files_to_process, unit="file", file=sys.stderr)
-    
-    for f in pbar:
-        pbar.set_description(f"Ingesting {f}")
-        # sys.stderr.write(f"Processing {f}...\n")
+    model = get_model() # torch/sentence_transformers only load when there is work
+    cache = ExtractionCache()
+    cached_paths = []
+    paths = []
+    rel_paths = {} # full path -> metadata key
+    for f in files_to_process:
         full_path = os.path.join(source_dir, f)
-        
-        # Remove old version if it existed (update case)
-        if table and f in metadata:
-             try:
-                table.delete(f"source = '{f}'")
-             except: pass 
+        rel_paths[full_path] = f
+        if cache.has(file_hashes[f]):
+            cached_paths.append(full_path)
+        else:
+            paths.append(full_path)
 
-        try:
-            text, method = extract_text(full_path)
-            if not text:
-                sys.stderr.write(f"  [Warn] Empty text context for {f}\n")
-                errors.append(f"{f} (empty)")
+    def iter_cached():
+        for full_path in cached_paths:
+            entry = cache.get(file_hashes[rel_paths[full_path]])
+            if entry:
+                yield full_path, entry["text"], entry["method"] + "+cache", entry["chunks"], None, False
+            else:
+                yield _extract_job(full_path)
+
+    workers = max(1, workers or EXTRACT_WORKERS)
+    sys.stderr.write(f"[System] {len(cached_paths)} file(s) from extraction cache, extracting {len(paths)} with {min(workers, max(1, len(paths)))} worker(s)...\n")
+    results = itertools.chain(iter_cached(), iter_extracted(paths, workers) if paths else [])
+    pbar = tqdm(results, total=len(files_to_process), unit="file", file=sys.stderr)
+
+    writer = BatchWriter(db, metadata, source_dir)
+    writer.start()
+    pending_rows = []
+    # Rows of deleted files go away in the same commit as the first batch
+    pending_replace = list(deleted_files) if table is not None else []
+    pending_forget = list(deleted_files)
+    pending_files = {}
+    pending_embed = [] # indexes into pending_rows still waiting for a vector
+    batch_size = max(1, batch_size or EMBED_BATCH_SIZE)
+    embed_seconds = 0.0
+
+    def flush():
+        # Embed the chunks of every pending document together (cross-document batches)
+        nonlocal embed_seconds
+        if pending_embed:
+            started = time.perf_counter()
+            vectors = embed_texts(model, [pending_rows[i]["text"] for i in pending_embed], batch_size)
+            embed_seconds += time.perf_counter() - started
+            for i, vector in zip(pending_embed, vectors):
+                pending_rows[i]["vector"] = vector
+            if embed_seconds > 0:
+                pbar.set_postfix(chunks_s=f"{embedded_count / embed_seconds:.1f}")
+        writer.submit(list(pending_rows), list(pending_replace), dict(pending_files), list(pending_forget))
+        pending_rows.clear()
+        pending_replace.clear()
+        pending_forget.clear()
+        pending_files.clear()
+        pending_embed.clear()
+    
+    try:
+        for full_path, text, method, chunks, error, partial in pbar:
+            f = rel_paths[full_path]
+            pbar.set_description(f"Ingesting {f}")
+
+            # Partial text (failed OCR pages) is never cached: the next run re-extracts
+            if text and not partial and not method.endswith("+cache"):
+                cache.put(file_hashes[f], text, method, chunks)
+
+            is_update = table is not None and f in metadata
+
+            if error:
+                sys.stderr.write(f"  [Error] Failed {f}: {error}\n")
+                errors.append(f"{f} ({error})")
+                if is_update:
+                    pending_replace.append(f) # Drop the outdated rows; retried next run
                 continue
-            
-            chunks = chunk_text(text)
-            
-            # Embed
-            embeddings = model.encode(chunks)
-            
-            for i, chunk in enumerate(chunks):
-                data_to_insert.append({
-                    "vector": embeddings[i],
-                    "text": chunk,
-                    "source": f,
-                    "id": f"{f}_{i}"
-                })
-            
-            # Update metadata on success
-            metadata[f] = current_files[f]
-            processed_count += 1
-            
+
+            try:
+                if not text:
+                    sys.stderr.write(f"  [Warn] Empty text context for {f}\n")
+                    errors.append(f"{f} (empty)")
+                    if is_update:
+                        pending_replace.append(f)
+                    continue
+
+                # Reuse stored vectors for unchanged chunks; the rest is queued
+                # and embedded with other documents' chunks in flush()
+                hashes = [chunk_hash(c) for c in chunks]
+                reusable = load_chunk_vectors(table, f) if is_update else {}
+                
+                for i, chunk in enumerate(chunks):
+                    vector = reusable.get(hashes[i])
+                    if vector is None:
+                        pending_embed.append(len(pending_rows))
+                        embedded_count += 1
+                    else:
+                        reused_count += 1
+                    pending_rows.append({
+                        "vector": vector,
+                        "text": chunk,
+                        "source": f,
+                        "id": f"{f}_{i}",
+                        "chunk_hash": hashes[i]
+                    })
+                if is_update:
+                    pending_replace.append(f)
+                
+                # Metadata is updated by the writer once this batch is committed.
+                # A partial file gets an entry without mtime/sha256: it is
+                # re-extracted next run (and its rows replaced or deleted then).
+                if partial:
+                    sys.stderr.write(f"  [Warn] {f}: some pages failed OCR, will retry next run\n")
+                    errors.append(f"{f} (partial: OCR failed on some pages)")
+                    pending_files[f] = {"partial": True}
+                else:
+                    pending_files[f] = {"mtime": current_files[f], "sha256": file_hashes[f]}
+                processed_count += 1
+                
+            except Exception as e:
+                sys.stderr.write(f"  [Error] Failed {f}: {e}\n")
+                errors.append(f"{f} ({str(e)})")
+                #traceback.print_exc()
+                continue
+
+            if len(pending_rows) >= INGEST_BATCH_ROWS:
+                flush()
+
+        if pending_files or pending_replace or pending_forget:
+            flush()
+    finally:
+        writer.close()
+
+    vector_index = None
+    fts_index = None
+    if TABLE_NAME in db.table_names():
+        table = db.open_table(TABLE_NAME)
+    if writer.rows_written:
+        # FTS Index for Keyword Search support (incremental, see update_fts_index)
+        try:
+            fts_index = update_fts_index(table)
+            sys.stderr.write(f"[System] FTS Index: {fts_index}.\n")
         except Exception as e:
-            sys.stderr.write(f"  [Error] Failed {f}: {e}\n")
-            errors.append(f"{f} ({str(e)})")
-            #traceback.print_exc()
+            sys.stderr.write(f"[Warning] Could not update FTS index: {e}\n")
 
-    if data_to_insert:
-        if TABLE_NAME in db.table_names():
-            table = db.open_table(TABLE_NAME)
-            table.add(data_to_insert)
-        else:
-            table = db.create_table(TABLE_NAME, data=data_to_insert)
-        
-        # Create FTS Index for Keyword Search support
+        # ANN index once the corpus is large enough for brute force to hurt
         try:
-            table.create_fts_index("text", replace=True)
-            sys.stderr.write("[System] FTS Index created/updated.\n")
+            vector_index = ensure_vector_index(table, index_min_rows or VECTOR_INDEX_MIN_ROWS)
         except Exception as e:
-            sys.stderr.write(f"[Warning] Could not create FTS index: {e}\n")
+            sys.stderr.write(f"[Warning] Could not build vector index: {e}\n")
+
+    maintenance = maybe_maintain(table, db_path) if table is not None else None
 
-    # Save updated metadata TO source_dir
-    save_metadata(metadata, source_dir)
+    # Metadata was saved TO source_dir after every committed batch
+    if touched_only:
+        save_metadata(metadata, source_dir)
+    cache.evict()
 
     result = {
         "status": "success",
         "count": processed_count,
         "skipped": skipped_count,
+        "deleted": len(deleted_files),
+        "embedded_chunks": embedded_count,
+        "reused_chunks": reused_count,
+        "chunks_per_second": round(embedded_count / embed_seconds, 1) if embed_seconds else None,
+        "vector_index": vector_index,
+        "fts_index": fts_index,
+        "maintenance": maintenance,
         "errors": errors
     }
     print(json.dumps(result))
 
+def handle_request(retriever, req):
+    """
+    Dispatches one JSON request (search | search_batch | ping) and returns the
+    response dict. Shared by the stdin `serve` loop and the socket `daemon`.
+    """
+    action = req.get("action")
+
+    if action == "search":
+        query = req.get("query", "")
+        mode = req.get("mode", SEARCH_MODE)
+        sys.stderr.write(f"[DEBUG] Search requested (mode={mode}): {query[:80]}\n")
+        # Search (vector | fts | hybrid); [] while the table does not exist
+        try:
+            results = retriever.search(query, req.get("limit", 5), mode,
+                                       req.get("nprobes"), req.get("refine_factor"))
+            sys.stderr.write(f"[DEBUG] Found {len(results)} results.\n")
+        except Exception as e:
+            sys.stderr.write(f"[Search Error while searching] {e}\n")
+            results = []
+        # Slice to prevent huge payloads
+        return {"status": "success", "data": [{**r, "text": r["text"][:2000]} for r in results]}
+
+    if action == "search_batch":
+        queries = req.get("queries") or []
+        sys.stderr.write(f"[DEBUG] Batch search requested: {len(queries)} queries\n")
+        try:
+            batches = retriever.search_many(queries, req.get("limit", 5), req.get("mode", SEARCH_MODE),
+                                            req.get("nprobes"), req.get("refine_factor"))
+        except Exception as e:
+            sys.stderr.write(f"[Search Error while batch searching] {e}\n")
+            return {"status": "error", "message": str(e)}
+        return {"status": "success", "data": [[{**r, "text": r["text"][:2000]} for r in results] for results in batches]}
+
+    if action == "ping":
+        # Answered right away, also while the model is still loading
+        return {"status": "pong", "ready": retriever.ready.is_set(), "cache": retriever.cache_stats()}
+
+    return {"status": "error", "message": f"Unknown action: {action}"}
+
+def warm_up_retriever(retriever):
+    # Pre-load model and DB
+    try:
+        sys.stderr.write("[RAG Server] Loading Model...\n")
+        retriever.model # This is slow
+        sys.stderr.write("[RAG Server] Connecting DB...\n")
+        retriever.get_table()
+        sys.stderr.write("[RAG Server] Warm-up complete.\n")
+    except Exception as e:
+        # Requests retry the lazy loads and report the error themselves
+        sys.stderr.write(f"[RAG Server] Warm-up failed: {e}\n")
+    finally:
+        retriever.ready.set()
+
+def start_warm_up(retriever):
+    """Loads model + table in the background so the loop answers ping at once."""
+    threading.Thread(target=warm_up_retriever, args=(retriever,), name="rag-warmup", daemon=True).start()
+
 def cmd_serve():
     sys.stderr.write("[RAG Server] Starting...\n")
-    # Pre-load model and DB
-    sys.stderr.write("[RAG Server] Loading Model...\n")
-    model = get_model() # This is slow
-    
-    sys.stderr.write("[RAG Server] Connecting DB...\n")
-    db_path = get_db_path()
-    db = lancedb.connect(db_path)
-    
-    sys.stderr.write("[RAG Server] Ready. Listening on stdin.\n")
+    retriever = KnowledgeRetriever()
+    start_warm_up(retriever)
+    sys.stderr.write("[RAG Server] Listening on stdin (warming up in background).\n")
     
     while True:
         try:
@@ -341,64 +1741,168 @@ def cmd_serve():
             line = line.strip()
             if not line: continue
             
-            req = json.loads(line)
-            
-            if req.get("action") == "search":
-                sys.stderr.write(f"[DEBUG] Search requested: {req}\n")
-                query = req.get("query", "")
-                limit = req.get("limit", 5)
-                
-                # Check table existence
-                if TABLE_NAME not in db.table_names():
-                    sys.stderr.write(f"[DEBUG] Table {TABLE_NAME} not found.\n")
-                    print(json.dumps({"status": "success", "data": []}))
-                    sys.stdout.flush()
-                    continue
+            response = handle_request(retriever, json.loads(line))
+        except Exception as e:
+            response = {"status": "error", "message": str(e)}
+        try:
+            print(json.dumps(response, ensure_ascii=True))
+        except Exception as e:
+            sys.stderr.write(f"[Output Error] Failed to print/serialize: {e}\n")
+            print(json.dumps({"status": "error", "message": f"Serialization error: {str(e)}"}))
+        sys.stdout.flush()
 
-                table = db.open_table(TABLE_NAME)
-                
-                # Search (Semantic/Vector)
-                try:
-                    sys.stderr.write(f"[DEBUG] Encoding query...\n")
-                    query_vector = model.encode(query)
-                    sys.stderr.write(f"[DEBUG] Searching LanceDB...\n")
-                    results = table.search(query_vector).limit(limit).to_list()
-                    sys.stderr.write(f"[DEBUG] Found {len(results)} results.\n")
-                except Exception as e:
-                    sys.stderr.write(f"[Search Error while searching] {e}\n")
-                    results = []
-                
-                # Format output
-                clean_results = []
-                try:
-                    for r in results:
-                        clean_results.append({
-                            "text": r.get("text", "")[:2000], # Slice to prevent huge payloads
-                            "source": r.get("source", "unknown"),
-                            "score": 0
-                        })
-                    
-                    sys.stderr.write(f"[DEBUG] Serializing {len(clean_results)} results...\n")
-                    json_output = json.dumps({"status": "success", "data": clean_results}, ensure_ascii=True)
-                    
-                    sys.stderr.write(f"[DEBUG] Printing to stdout...\n")
-                    print(json_output)
-                    sys.stdout.flush()
-                    sys.stderr.write(f"[DEBUG] Flush complete.\n")
-                except Exception as e:
-                     sys.stderr.write(f"[Output Error] Failed to print/serialize: {e}\n")
-                     print(json.dumps({"status": "error", "message": f"Serialization error: {str(e)}"}))
-                     sys.stdout.flush()
-
-
-            elif req.get("action") == "ping":
-                print(json.dumps({"status": "pong"}))
-                sys.stdout.flush()
+# ---------------------------------------------------------
+# DAEMON (mesmo motor do serve, acessível por socket local)
+# ---------------------------------------------------------
 
-        except Exception as e:
-            # sys.stderr.write(f"[RAG Error] {e}\n")
-            print(json.dumps({"status": "error", "message": str(e)}))
-            sys.stdout.flush()
+def get_daemon_info_path():
+    return os.path.join(script_dir, DAEMON_INFO_REL_PATH)
+
+class _DaemonHandler(socketserver.StreamRequestHandler):
+    """One connection = any number of JSON-line requests, answered in order."""
+
+    def handle(self):
+        for raw in self.rfile:
+            line = raw.decode('utf-8').strip()
+            if not line:
+                continue
+            try:
+                req = json.loads(line)
+                if req.get("token") != self.server.token:
+                    response = {"status": "error", "message": "Invalid token"}
+                else:
+                    response = handle_request(self.server.retriever, req)
+            except Exception as e:
+                response = {"status": "error", "message": str(e)}
+            self.wfile.write((json.dumps(response, ensure_ascii=True) + "\n").encode('utf-8'))
+            self.wfile.flush()
+
+class _DaemonServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def cmd_daemon(port=None):
+    """
+    Long-lived search service on 127.0.0.1. Address and access token go to
+    DAEMON_INFO_REL_PATH so one-shot clients (rag_search.py, ai_agent) reuse
+    this warm model instead of loading their own. Exits when stdin closes,
+    so it dies with the process that spawned it.
+    """
+    sys.stderr.write("[RAG Daemon] Starting...\n")
+    retriever = KnowledgeRetriever()
+
+    server = _DaemonServer((DAEMON_HOST, DAEMON_PORT if port is None else port), _DaemonHandler)
+    server.retriever = retriever
+    server.token = secrets.token_hex(16)
+    info = {"host": DAEMON_HOST, "port": server.server_address[1], "pid": os.getpid(), "token": server.token}
+
+    info_path = get_daemon_info_path()
+    os.makedirs(os.path.dirname(info_path), exist_ok=True)
+    tmp_path = f"{info_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(info, f)
+    os.replace(tmp_path, info_path)
+
+    threading.Thread(target=server.serve_forever, name="rag-daemon", daemon=True).start()
+    sys.stderr.write(f"[RAG Daemon] Listening on {DAEMON_HOST}:{info['port']} (warming up in background).\n")
+    start_warm_up(retriever)
+    try:
+        while sys.stdin.readline():
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        try:
+            with open(info_path) as f:
+                if json.load(f).get("pid") == os.getpid():
+                    os.remove(info_path)
+        except (OSError, ValueError):
+            pass
+        sys.stderr.write("[RAG Daemon] Stopped.\n")
+
+def query_daemon(req, timeout=DAEMON_REQUEST_TIMEOUT):
+    """
+    Sends one request to the running daemon and returns its response dict,
+    or None when no daemon is reachable (no info file, stale port, timeout).
+    """
+    try:
+        with open(get_daemon_info_path()) as f:
+            info = json.load(f)
+        with socket.create_connection((info["host"], info["port"]), timeout=DAEMON_CONNECT_TIMEOUT) as sock:
+            sock.settimeout(timeout)
+            payload = json.dumps({**req, "token": info.get("token")}) + "\n"
+            sock.sendall(payload.encode('utf-8'))
+            with sock.makefile('rb') as f:
+                line = f.readline()
+        return json.loads(line) if line else None
+    except (OSError, KeyError, TypeError, ValueError):
+        return None
+
+PARITY_SAMPLE_TEXTS = [
+    "Quem é o coordenador do NPJ?",
+    "Quais são os prazos para entrega dos relatórios de estágio?",
+    "O aluno deve cumprir a carga horária mínima no Núcleo de Prática Jurídica.",
+    "Art. 5º Todos são iguais perante a lei, sem distinção de qualquer natureza.",
+    "Horário de atendimento ao público: segunda a sexta, das 8h às 12h.",
+]
+
+def cmd_check_backend(backend, sample_size=200):
+    """
+    Parity check: cosine similarity between the PyTorch vectors and the ones
+    produced by `backend`, over stored chunks (or built-in samples).
+    """
+    import numpy as np
+
+    texts = list(PARITY_SAMPLE_TEXTS)
+    try:
+        import lancedb
+        db = lancedb.connect(get_db_path())
+        if TABLE_NAME in db.table_names():
+            rows = db.open_table(TABLE_NAME).search().select(["text"]).limit(sample_size).to_list()
+            texts += [r["text"] for r in rows]
+    except Exception as e:
+        sys.stderr.write(f"[Parity] Using built-in samples only: {e}\n")
+
+    timings = {}
+    vectors = {}
+    for name in ('torch', backend):
+        model = get_model(name)
+        model.encode(texts[:1]) # Warm-up
+        started = time.perf_counter()
+        vectors[name] = np.asarray(model.encode(texts, normalize_embeddings=True))
+        timings[name] = time.perf_counter() - started
+
+    cosine = (vectors['torch'] * vectors[backend]).sum(axis=1)
+    ok = bool(cosine.min() >= PARITY_MIN_COSINE)
+    print(json.dumps({
+        "status": "success" if ok else "error",
+        "backend": backend,
+        "texts": len(texts),
+        "cosine_min": round(float(cosine.min()), 5),
+        "cosine_mean": round(float(cosine.mean()), 5),
+        "threshold": PARITY_MIN_COSINE,
+        "seconds_torch": round(timings['torch'], 3),
+        f"seconds_{backend}": round(timings[backend], 3)
+    }))
+    return ok
+
+def parse_flags(args):
+    """Parses `--key value` pairs (and bare `--flag`) into a dict."""
+    opts = {}
+    i = 0
+    while i < len(args):
+        a = args[i]
+        if a.startswith("--"):
+            key = a[2:].replace("-", "_")
+            if i + 1 < len(args) and not args[i + 1].startswith("--"):
+                opts[key] = args[i + 1]
+                i += 1
+            else:
+                opts[key] = True
+        i += 1
+    return opts
 
 if __name__ == "__main__":
     sys.stdin.reconfigure(encoding='utf-8')
@@ -406,16 +1910,31 @@ if __name__ == "__main__":
     sys.stderr.reconfigure(encoding='utf-8')
     
     if len(sys.argv) < 2:
-        print("Usage: python rag_manager.py [ingest|serve] <args>")
+        print("Usage: python rag_manager.py [ingest|serve|daemon|maintain|check_backend] <args>")
         sys.exit(1)
         
     cmd = sys.argv[1]
     
     if cmd == "ingest":
         if len(sys.argv) < 3:
-            print("Usage: python rag_manager.py ingest <source_dir>")
+            print("Usage: python rag_manager.py ingest <source_dir> [--workers N] [--batch-size N] [--index-min-rows N]")
             sys.exit(1)
-        cmd_ingest(sys.argv[2])
+        opts = parse_flags(sys.argv[3:])
+        cmd_ingest(sys.argv[2], workers=int(opts.get("workers", 0)), batch_size=int(opts.get("batch_size", 0)),
+                   index_min_rows=int(opts.get("index_min_rows", 0)))
         
     elif cmd == "serve":
         cmd_serve()
+
+    elif cmd == "maintain":
+        opts = parse_flags(sys.argv[2:])
+        cmd_maintain(float(opts["retention_hours"]) if "retention_hours" in opts else None,
+                     reindex="reindex" in opts)
+
+    elif cmd == "daemon":
+        opts = parse_flags(sys.argv[2:])
+        cmd_daemon(int(opts["port"]) if "port" in opts else None)
+
+    elif cmd == "check_backend":
+        backend = sys.argv[2] if len(sys.argv) > 2 else EMBED_BACKEND
+        sys.exit(0 if cmd_check_backend(backend) else 1)
@@ -0,0 +1,119 @@
+"""
+Cold-start budget check for the Python services spawned by the Electron app.
+
+  1. Import budget (-X importtime): importing rag_manager / ai_agent must stay
+     under IMPORT_BUDGET_MS and must not pull heavy libraries at module level.
+  2. Ping budget: `serve` must answer a ping within PING_BUDGET_MS of spawn,
+     while the model/agent warm up in the background.
+
+Usage: python scripts/test_cold_start.py [--import-budget MS] [--ping-budget MS]
+Exits 1 when any budget is exceeded.
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_BUDGET_MS = 300
+PING_BUDGET_MS = 800
+# A service that never answers fails after budget * factor instead of hanging
+PING_TIMEOUT_FACTOR = 5
+# Must only be imported lazily (inside functions / warm-up threads)
+HEAVY_MODULES = ("lancedb", "sentence_transformers", "torch", "docling", "agno", "groq", "pyarrow", "pandas")
+SERVICES = ("rag_manager", "ai_agent")
+
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_profile(module):
+    """Returns (total_ms, modules) for `import module` in a fresh interpreter."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=script_dir, capture_output=True, text=True, encoding="utf-8", errors="replace"
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+    total_us = 0
+    modules = set()
+    for line in proc.stderr.splitlines():
+        m = IMPORTTIME_RE.match(line)
+        if not m:
+            continue
+        modules.add(m.group(4).split(".")[0])
+        if m.group(4) == module:
+            total_us = int(m.group(2)) # cumulative
+    return total_us / 1000, modules
+
+
+def ping_latency(module, budget_ms=PING_BUDGET_MS):
+    """
+    Spawns `<module>.py serve`, sends a ping and returns ms until the pong line.
+    Raises if no line arrives within budget_ms * PING_TIMEOUT_FACTOR.
+    """
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(script_dir, f"{module}.py"), "serve"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        text=True, encoding="utf-8", env={**os.environ, "PYTHONIOENCODING": "utf-8"}
+    )
+    try:
+        proc.stdin.write(json.dumps({"id": 1, "action": "ping"}) + "\n")
+        proc.stdin.flush()
+        # readline() has no timeout: read on a thread, wait with a deadline
+        reply = []
+        reader = threading.Thread(target=lambda: reply.append(proc.stdout.readline()), daemon=True)
+        reader.start()
+        timeout_ms = budget_ms * PING_TIMEOUT_FACTOR
+        reader.join(timeout_ms / 1000)
+        elapsed = (time.perf_counter() - started) * 1000
+        if not reply:
+            raise RuntimeError(f"no ping reply within {timeout_ms:.0f} ms")
+        line = reply[0]
+        if not line:
+            raise RuntimeError("service exited before answering the ping")
+        if json.loads(line).get("status") != "pong":
+            raise RuntimeError(f"unexpected reply: {line.strip()}")
+        return elapsed
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def main():
+    args = sys.argv[1:]
+    import_budget = float(args[args.index("--import-budget") + 1]) if "--import-budget" in args else IMPORT_BUDGET_MS
+    ping_budget = float(args[args.index("--ping-budget") + 1]) if "--ping-budget" in args else PING_BUDGET_MS
+
+    failures = []
+    for module in SERVICES:
+        try:
+            import_ms, modules = import_profile(module)
+            heavy = sorted(modules.intersection(HEAVY_MODULES))
+            print(f"{module}: import {import_ms:.0f} ms (budget {import_budget:.0f})")
+            if import_ms > import_budget:
+                failures.append(f"{module}: import took {import_ms:.0f} ms")
+            if heavy:
+                failures.append(f"{module}: heavy modules imported at load time: {', '.join(heavy)}")
+
+            ping_ms = ping_latency(module, ping_budget)
+            print(f"{module}: ping {ping_ms:.0f} ms (budget {ping_budget:.0f})")
+            if ping_ms > ping_budget:
+                failures.append(f"{module}: ping took {ping_ms:.0f} ms")
+        except Exception as e:
+            failures.append(f"{module}: {e}")
+
+    if failures:
+        print("\nCold start regression:")
+        for f in failures:
+            print(f"  - {f}")
+        sys.exit(1)
+    print("\nCold start within budget.")
+
+
+if __name__ == "__main__":
+    main()